@@ -0,0 +1,51 @@
+# Measures how long the lexer takes to tokenize the sample templates
+#
+# Usage: python bench/bench_lexer.py [repeat]
+#
+# Every template is also scaled by repeating its text so that parse time
+# growing faster than the size of the template shows up.
+
+import os
+import os.path
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import lex
+
+SAMPLE = os.path.join(ROOT, 'sample')
+SCALES = (1, 10, 100)
+# A page of static markup without any @ in it
+STATIC = "<div class=\"row\">\n  <span>Some text</span>\n</div>\n" * 20
+EXPRESSIONS = "<td>@(model[0])</td><td>@(', '.join(model))</td>\n" * 20
+
+
+def tokenize(text):
+    return list(lex.RazorLexer.create().scan(text))
+
+
+def templates():
+    for name in sorted(os.listdir(SAMPLE)):
+        if name.endswith('.pyhtml'):
+            with open(os.path.join(SAMPLE, name)) as f:
+                yield name, f.read()
+    yield '(static)', STATIC
+    yield '(expressions)', EXPRESSIONS
+
+
+def main(argv):
+    repeat = int(argv[1]) if len(argv) > 1 else 5
+    for name, text in templates():
+        for scale in SCALES:
+            scaled = (text + '\n') * scale
+            number = max(1, 1000 // scale)
+            best = min(timeit.repeat(lambda: tokenize(scaled), number=number, repeat=repeat)) / number
+            print("%-20s x%-4d %8d chars %6d tokens %10.3f ms" % (
+                name, scale, len(scaled), len(tokenize(scaled)), best * 1000))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,203 @@
+# Measures lexing, code generation, compiling and rendering of synthetic views
+#
+# Usage: python bench/bench_suite.py [-r repeat] [-t seconds] [-k filter]
+#                                    [--save results.json] [--compare baseline.json]
+#
+# Every case is timed in four phases: lex runs RazorLexer.scan, codegen is
+# View.generate less the time lex took, compile is ViewBuilder.compile turning
+# the generated code into a code object, folding the regions which do not
+# depend on the model, and render renders the compiled view through PyRazor.
+# Each phase reports operations per second and the peak memory allocated by
+# one operation, which needs python 3.4+.  --save writes the results as json,
+# --compare reports the change against such a file and exits with 1 when a
+# phase got slower than the threshold allows.
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+
+import lex
+from razorview import PyRazor, View, __version__
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PHASES = ('lex', 'codegen', 'compile', 'render')
+SIZES = (10, 100, 1000)
+# Expressions per line, 0 is static markup
+DENSITIES = (0, 1, 4)
+DEPTHS = (2, 4, 8)
+
+
+class Model(object):
+    """The model every case is rendered with"""
+
+    def __init__(self):
+        self.title = "Benchmark <&>"
+        self.values = list(range(8))
+        self.items = list(range(3))
+        self.rows = list(range(50))
+
+
+def page(size, density):
+    """Returns a view of size lines with density expressions on each"""
+    lines = []
+    for i in range(size):
+        cells = "".join("<td>@(model.values[%d])</td>" % ((i + j) % 8) if j % 2 else "<td>@model.title</td>"
+                        for j in range(density))
+        lines.append("<tr class=\"row\"><td>static text %d</td>%s</tr>" % (i, cells))
+    return "\n".join(lines) + "\n"
+
+
+def nested(depth):
+    """Returns a view nesting depth alternating @for and @if blocks"""
+    lines = []
+    for level in range(depth):
+        if level % 2:
+            lines.append("\t" * level + "@if v%d != 1:" % (level - 1))
+        else:
+            lines.append("\t" * level + "@for v%d in model.items:" % level)
+    names = " ".join("@v%d" % level for level in range(0, depth, 2))
+    lines.append("\t" * depth + "<span>%s</span>" % names)
+    return "<div>\n" + "\n".join(lines) + "\n</div>\n"
+
+
+LAYOUT = "<html>\n<head><title>@model.title</title></head>\n<body>\n@view.body()\n</body>\n</html>\n"
+PARTIAL = "<li class=\"row\">@model</li>\n"
+CONSTANT = "<table>\n@for i in range(20):\n\t<tr><td>@i</td>\n\t@if i % 2:\n\t\t<td>odd</td>\n\t</tr>\n</table>\n" \
+    "<p>@model.title</p>\n"
+WRAPPED = "@view.wrap('layout.pyhtml')\n<ul>\n@for row in model.rows:\n\t@view.tmpl('row.pyhtml', row)\n</ul>\n"
+
+
+def cases():
+    """Yields the name, the files and the view rendered of every case"""
+    for size in SIZES:
+        for density in DENSITIES:
+            yield 'page-%d-%d' % (size, density), {'page.pyhtml': page(size, density)}, 'page.pyhtml'
+    for depth in DEPTHS:
+        yield 'nested-%d' % depth, {'nested.pyhtml': nested(depth)}, 'nested.pyhtml'
+    yield 'constant', {'constant.pyhtml': CONSTANT}, 'constant.pyhtml'
+    yield 'layout', {'page.pyhtml': WRAPPED, 'layout.pyhtml': LAYOUT, 'row.pyhtml': PARTIAL}, 'page.pyhtml'
+
+
+def measure(operation, repeat, min_time):
+    """Returns the best seconds per operation and the peak bytes it allocated"""
+    number = 1
+    while True:
+        seconds = timeit.timeit(operation, number=number)
+        if seconds >= min_time / repeat or number >= 1 << 20:
+            break
+        number *= 2
+    best = min(timeit.repeat(operation, number=number, repeat=repeat)) / number
+
+    peak = None
+    if tracemalloc is not None:
+        tracemalloc.start()
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_case(files, entry, repeat, min_time):
+    """Returns the seconds per operation and the peak bytes of each phase"""
+    text = files[entry]
+    builder = View.generate(text, False)
+    results = dict()
+    results['lex'] = measure(lambda: list(lex.RazorLexer.create().scan(text)), repeat, min_time)
+    generate = measure(lambda: View.generate(text, False).get_template(), repeat, min_time)
+    results['codegen'] = (max(generate[0] - results['lex'][0], 1e-9), generate[1])
+    results['compile'] = measure(builder.compile, repeat, min_time)
+
+    root = tempfile.mkdtemp()
+    try:
+        for name, content in files.items():
+            with open(os.path.join(root, name), 'w') as f:
+                f.write(content)
+        razor = PyRazor()
+        razor.ViewRoot = [root]
+        model = Model()
+        razor.render_file(entry, model)
+        results['render'] = measure(lambda: razor.render_file(entry, model), repeat, min_time)
+    finally:
+        shutil.rmtree(root)
+    return results
+
+
+def run(repeat, min_time, pattern=None):
+    results = dict()
+    for name, files, entry in cases():
+        if pattern is not None and pattern not in name:
+            continue
+        timings = run_case(files, entry, repeat, min_time)
+        for phase in PHASES:
+            seconds, peak = timings[phase]
+            results['%s/%s' % (name, phase)] = {
+                'ops': 1.0 / seconds,
+                'seconds': seconds,
+                'peak_kb': peak / 1024.0 if peak is not None else None,
+            }
+    return results
+
+
+def report(results, baseline=None, threshold=0.2):
+    """Prints the results, returns the names of the phases slower than the baseline"""
+    slower = []
+    print("%-24s %14s %12s %10s" % ("case/phase", "ops/sec", "peak kb", "change"))
+    for name in sorted(results):
+        result = results[name]
+        peak = "%12.1f" % result['peak_kb'] if result['peak_kb'] is not None else "%12s" % "-"
+        change = ""
+        if baseline is not None and name in baseline:
+            ratio = result['ops'] / baseline[name]['ops']
+            change = "%+9.1f%%" % ((ratio - 1) * 100)
+            if ratio < 1 - threshold:
+                change += " slower"
+                slower.append(name)
+        print("%-24s %14.1f %s %10s" % (name, result['ops'], peak, change))
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks lexing, compiling and rendering views")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="timings taken of each phase, the best is kept")
+    parser.add_argument('-t', '--time', type=float, default=0.2, help="seconds each phase is timed for at least")
+    parser.add_argument('-k', '--filter', help="only run the cases whose name contains this")
+    parser.add_argument('--save', help="json file the results are written to")
+    parser.add_argument('--compare', help="json file of earlier results to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fraction of ops/sec a phase may lose before it counts as slower")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.time, args.filter)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+    slower = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'version': __version__,
+                'python': platform.python_version(),
+                'implementation': platform.python_implementation(),
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
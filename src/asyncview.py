@@ -0,0 +1,119 @@
+# Renders views on an asyncio event loop, this module needs python 3.6+
+#
+# Views compiled with PyRazor.Asynchronous set carry a coroutine variant of
+# their template.  It awaits the value of an expression when it is awaitable
+# and its for loops iterate over async iterables as well as plain ones.
+# Partials rendered by view.tmpl or view.fragment from the template body are
+# rendered asynchronously as well, functions defined by the template and the
+# partials they render stay synchronous.
+
+import asyncio
+import inspect
+import sys
+from io import StringIO
+
+from razorview import StreamIO, ViewContext
+
+isawaitable = inspect.isawaitable
+
+
+async def iterate(iterable):
+    """Iterates over an async iterable or a plain one"""
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
+
+
+def called_from_coroutine():
+    """Returns whether the caller of the calling function is a coroutine which awaits what it gets"""
+    return bool(sys._getframe(2).f_code.co_flags & inspect.CO_COROUTINE)
+
+
+class AsyncViewContext(ViewContext):
+    """
+  The view object seen by the coroutine variant of a template.  Called from
+  the template body tmpl and fragment return a coroutine which the template
+  awaits, partials are then rendered through their own coroutine variant.
+  """
+
+    def tmpl(self, file, submodel=None):
+        if not called_from_coroutine():
+            return ViewContext.tmpl(self, file, submodel)
+        return self.tmpl_async(file, submodel)
+
+    def fragment(self, file, key, submodel=None, ttl=None, tags=()):
+        if not called_from_coroutine():
+            return ViewContext.fragment(self, file, key, submodel, ttl, tags)
+        return self.fragment_async(file, key, submodel, ttl, tags)
+
+    async def tmpl_async(self, file, submodel=None):
+        view = self.razor.get_view(file, self.ignore_whitespace)
+        await render_to(view, self.io, submodel or self.model)
+
+    async def fragment_async(self, file, key, submodel=None, ttl=None, tags=()):
+        for _ in self.cached(key, ttl, tags):
+            await self.tmpl_async(file, submodel)
+
+
+class AsyncBuffer(StringIO):
+    """Collects the output of a coroutine template, it is never flushed"""
+    full = False
+
+
+class AsyncStreamIO(StreamIO):
+    """Collects the output of a coroutine template and writes it to an asyncio stream in chunks"""
+
+    def __init__(self, writer, chunk_size, encoding='utf-8'):
+        StreamIO.__init__(self, chunk_size)
+        self.writer = writer
+        self.encoding = encoding
+
+    async def flush(self):
+        """Writes the collected output and gives the event loop a turn"""
+        value = self.take()
+        if value:
+            self.writer.write(value.encode(self.encoding))
+            await self.writer.drain()
+        await asyncio.sleep(0)
+
+
+async def render_to(view, io, model=None, body=''):
+    """Renders a view and its layout into io"""
+    if view.async_template is None:
+        view.render_to(io, model, body)
+        return
+    if not view.wraps:
+        context = AsyncViewContext(view, io, model, body)
+        await view.async_template(context, io, model)
+        view.check_layout(context)
+        return
+
+    # The layout is only known once the view is rendered so its output is held back
+    buffer = AsyncBuffer()
+    context = AsyncViewContext(view, buffer, model, body)
+    await view.async_template(context, buffer, model)
+    if context.layout is None:
+        io.write(buffer.getvalue())
+    else:
+        layout = view.razor.get_view(context.layout, view.ignore_whitespace)
+        await render_to(layout, io, context.layout_model, buffer.getvalue())
+    buffer.close()
+
+
+async def render(view, model=None, body=''):
+    """Renders a view and returns its output"""
+    io = AsyncBuffer()
+    await render_to(view, io, model, body)
+    value = io.getvalue()
+    io.close()
+    return value
+
+
+async def stream(view, writer, model=None, chunk_size=8192, body=''):
+    """Renders a view into an asyncio StreamWriter in chunks of about chunk_size characters"""
+    io = AsyncStreamIO(writer, chunk_size)
+    await render_to(view, io, model, body)
+    await io.flush()
@@ -0,0 +1,272 @@
+# Handles caching compiled views
+
+import hashlib
+import marshal
+import os
+import os.path
+import tempfile
+import threading
+import time
+import types
+import uuid
+from collections import OrderedDict
+
+try:
+    from importlib.util import MAGIC_NUMBER
+except ImportError:
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+
+
+class BytecodeCache(object):
+    """
+  Persists the code objects built by a ViewBuilder in a directory so that
+  a template is only lexed and compiled once.  Entries are keyed by the
+  template text, the ignore_whitespace flag, the engine version and the
+  interpreter's bytecode magic number.
+  """
+
+    def __init__(self, directory):
+        self.directory = directory
+        make_directory(directory)
+
+    @staticmethod
+    def key(text, ignore_whitespace, version):
+        """Returns the cache key of a template"""
+        if not isinstance(text, bytes):
+            text = text.encode('utf-8')
+        digest = hashlib.sha1(MAGIC_NUMBER)
+        digest.update(version.encode('ascii'))
+        digest.update(b'\x01' if ignore_whitespace else b'\x00')
+        digest.update(text)
+        return digest.hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + '.rzc')
+
+    def load(self, key):
+        """Returns the cached code object or None if it is missing or unreadable"""
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                code = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(code, types.CodeType):
+            return None
+        return code
+
+    def store(self, key, code):
+        """Writes the code object, a partially written entry is never visible"""
+        write_marshalled(self.directory, self.get_path(key), code)
+
+
+def make_directory(directory):
+    """
+  Creates a cache directory, one which can not be created leaves the cache
+  missing every lookup and dropping every entry.
+  """
+    try:
+        os.makedirs(directory)
+    except OSError:
+        # Another process may have created it first
+        pass
+
+
+def write_marshalled(directory, path, value):
+    """Writes a marshalled value to path through a temporary file so it is never seen half written"""
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(value, f)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        # A missing or read only directory only costs the entry
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class LRUCache(object):
+    """
+  A thread safe least recently used cache bounded by its number of entries
+  and by the approximate size of its entries.  Entries may also expire after
+  ttl seconds.  Hits, misses and evictions are counted so the limits can be
+  sized.
+
+  @param max_entries  the maximum number of entries or None for no limit
+  @param max_bytes    the maximum total size of the entries or None for no limit
+  @param ttl          the number of seconds an entry lives or None to keep it
+  """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        """Returns the value of key and marks it as the most recently used"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            if entry[2] is not None and entry[2] < time.time():
+                self.bytes -= entry[1]
+                self.misses += 1
+                self.evictions += 1
+                return default
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size=0):
+        """Stores value under key evicting the least recently used entries to stay in bounds"""
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size, expires)
+            self.bytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Returns the counters of this cache as a dict"""
+        return dict(entries=len(self._entries), bytes=self.bytes, hits=self.hits,
+                    misses=self.misses, evictions=self.evictions)
+
+    def _evict(self):
+        # The most recently stored entry is always kept even if it is too large
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            self.bytes -= self._entries.popitem(last=False)[1][1]
+            self.evictions += 1
+
+
+class FileStore(object):
+    """
+  Keeps entries in files below a directory so that the processes of a
+  machine share them, a directory below /dev/shm keeps them in shared memory.
+  It has the get, set and pop methods of LRUCache, values must be
+  marshallable.
+  """
+
+    def __init__(self, directory):
+        self.directory = directory
+        make_directory(directory)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.frag')
+
+    def get(self, key, default=None):
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                return marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return default
+
+    def set(self, key, value, size=0):
+        write_marshalled(self.directory, self.get_path(key), value)
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        try:
+            os.remove(self.get_path(key))
+        except OSError:
+            pass
+        return value
+
+    def clear(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            if name.endswith('.frag'):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+class FragmentCache(object):
+    """
+  Caches the rendered output of parts of views under explicit keys.  Entries
+  may expire after ttl seconds and carry tags, invalidating a tag drops every
+  entry tagged with it.  Each tag has a version which is stored with the
+  entries and replaced when the tag is invalidated, an entry whose tag lost
+  its version is dropped as well.
+
+  @param store  holds the entries, anything with the get, set and pop methods
+                of LRUCache such as a FileStore, an in-process LRUCache of
+                16MB by default
+  """
+
+    def __init__(self, store=None):
+        if store is None:
+            store = LRUCache(max_bytes=16 << 20)
+        self.store = store
+
+    def get(self, key):
+        """Returns the text cached under key or None"""
+        entry = self.store.get('fragment:' + key)
+        if entry is None:
+            return None
+        value, expires, tags = entry
+        if expires is not None and expires < time.time():
+            self.store.pop('fragment:' + key)
+            return None
+        for tag, version in tags:
+            if self.store.get('tag:' + tag) != version:
+                return None
+        return value
+
+    def set(self, key, value, ttl=None, tags=()):
+        """Caches value under key for ttl seconds or until one of its tags is invalidated"""
+        expires = time.time() + ttl if ttl is not None else None
+        versions = []
+        for tag in tags:
+            version = self.store.get('tag:' + tag)
+            if version is None:
+                version = self.invalidate(tag)
+            versions.append((tag, version))
+        self.store.set('fragment:' + key, (value, expires, tuple(versions)), len(value))
+
+    def delete(self, key):
+        self.store.pop('fragment:' + key)
+
+    def invalidate(self, tag):
+        """Drops every entry tagged with tag, returns the new version of the tag"""
+        version = uuid.uuid4().hex
+        self.store.set('tag:' + tag, version)
+        return version
@@ -0,0 +1,64 @@
+# Html escaping of template output
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+class Markup(text_type):
+    """Text which is already html and is output by templates without escaping"""
+
+    def __html__(self):
+        return self
+
+
+def escape(value):
+    """Html escapes a value converting it to text.
+
+  Values with an __html__ method such as Markup are trusted and returned as
+  html.  Chained replace calls are used on purpose, each one is a C level scan
+  which returns text without any special character untouched and they beat
+  str.translate and re.sub by a wide margin.
+  """
+    if value.__class__ is not text_type:
+        if hasattr(value, '__html__'):
+            return value.__html__()
+        value = text_type(value)
+    if u'&' in value:
+        value = value.replace(u'&', u'&amp;')
+    if u'<' in value:
+        value = value.replace(u'<', u'&lt;')
+    if u'>' in value:
+        value = value.replace(u'>', u'&gt;')
+    return value
+
+
+def encoded_escape(encoding):
+    """Returns a version of escape which encodes the html it returns"""
+
+    def escape_encoded(value):
+        if value.__class__ is not text_type:
+            if hasattr(value, '__html__'):
+                return value.__html__().encode(encoding)
+            value = text_type(value)
+        if u'&' in value:
+            value = value.replace(u'&', u'&amp;')
+        if u'<' in value:
+            value = value.replace(u'<', u'&lt;')
+        if u'>' in value:
+            value = value.replace(u'>', u'&gt;')
+        return value.encode(encoding)
+
+    return escape_encoded
+
+
+def encoded_text(encoding):
+    """Returns a function converting a value to encoded text"""
+
+    def text_encoded(value):
+        if value.__class__ is not text_type:
+            value = text_type(value)
+        return value.encode(encoding)
+
+    return text_encoded
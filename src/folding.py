@@ -0,0 +1,424 @@
+# Folds the regions of generated template code which do not depend on the
+# model into constants
+#
+# A region is an if over a constant or a for loop over a literal whose body
+# only writes segments and expressions of constants and loop variables.  It
+# is run once here and replaced by a write of its output, which becomes a new
+# segment.  The names it bound are assigned their final value so code after
+# it sees them as before.  An if over a constant which can not be folded
+# still loses the branch which is never taken.  range and the escape functions
+# are only called while the template does not bind those names itself, and a
+# value growing past the limits below leaves its region to the render.
+
+import ast
+import copy
+import numbers
+import re
+import sys
+
+from escape import escape, text_type
+
+# Candidates for folding, an if or for line whose expression may be constant
+CANDIDATE = re.compile(r"^[ \t]*(?:(?:el)?if|for[ \t].*?[ \t]in)[ \t]+(.*?):[ \t]*$", re.M)
+
+# Limits keeping a folded region from blowing up the code and the compile
+MAX_STEPS = 10000
+MAX_SIZE = 65536
+MAX_BITS = 4096
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+CONSTANT_NAMES = {'True': True, 'False': False, 'None': None}
+
+EXPRESSIONS = tuple(getattr(ast, name) for name in (
+    'Expression', 'Constant', 'Num', 'Str', 'Bytes', 'NameConstant', 'Name', 'BinOp', 'UnaryOp', 'BoolOp',
+    'Compare', 'IfExp', 'Subscript', 'Index', 'Slice', 'Tuple', 'List', 'Set', 'Dict', 'Call', 'Attribute',
+    'expr_context', 'operator', 'unaryop', 'boolop', 'cmpop') if hasattr(ast, name))
+
+
+class NotConstant(Exception):
+    """Raised when a region depends on something only known while rendering"""
+
+
+def bounded_range(*args):
+    """range, refusing more steps than a folded region may take"""
+    if len(xrange(*args)) > MAX_STEPS:
+        raise NotConstant()
+    return range(*args)
+
+
+CONSTANT_CALLS = {'range': bounded_range, '__escape': escape, '__text': text_type}
+
+
+def has_candidates(code):
+    """Returns whether generated code has an if or for over a constant"""
+    for match in CANDIDATE.finditer(code):
+        try:
+            check_expression(ast.parse(match.group(1).strip(), mode='eval'), ())
+            return True
+        except (SyntaxError, NotConstant):
+            pass
+    return False
+
+
+def check_expression(node, names, calls=CONSTANT_CALLS):
+    """Raises NotConstant unless the expression only uses constants, the given names and calls"""
+    for child in ast.walk(node):
+        if not isinstance(child, EXPRESSIONS):
+            raise NotConstant()
+        if isinstance(child, ast.Name) and child.id not in names and child.id not in CONSTANT_NAMES and \
+                child.id not in calls:
+            raise NotConstant()
+        if isinstance(child, ast.Call):
+            if not isinstance(child.func, ast.Name) or child.func.id not in calls or \
+                    child.keywords or getattr(child, 'starargs', None) or getattr(child, 'kwargs', None):
+                raise NotConstant()
+        if isinstance(child, ast.Attribute) and child.attr != '__class__':
+            raise NotConstant()
+
+
+def bound_names(function):
+    """
+  Returns the names a template function binds itself: assigned, deleted,
+  imported, caught or taken by a nested function.  Its own parameters are
+  generated and left out.
+  """
+    names = set()
+    for node in ast.walk(function):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, (ast.Load, getattr(ast, 'Param', ast.Load))):
+            names.add(node.id)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+        elif isinstance(node, (ast.FunctionDef, ast.ClassDef)) and node is not function:
+            names.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and isinstance(node.name, str):
+            names.add(node.name)
+        elif isinstance(node, ast.Global):
+            names.update(node.names)
+        if isinstance(node, (ast.FunctionDef, ast.Lambda)) and node is not function:
+            names.update(argument_names(node.args))
+    return names
+
+
+def argument_names(arguments):
+    names = set()
+    for argument in arguments.args + getattr(arguments, 'kwonlyargs', []) + getattr(arguments, 'posonlyargs', []):
+        # Python 2 keeps parameters as Name nodes, a tuple parameter binds each of its names
+        for node in ast.walk(argument):
+            if isinstance(node, ast.Name):
+                names.add(node.id)
+            elif isinstance(node, getattr(ast, 'arg', ())):
+                names.add(node.arg)
+    for argument in (arguments.vararg, arguments.kwarg):
+        if argument is not None:
+            names.add(getattr(argument, 'arg', argument))
+    return names
+
+
+def guarded_operation(name, left, right):
+    """Applies a multiplication, power or shift unless its result would be too big"""
+    integers = isinstance(left, numbers.Integral) and isinstance(right, numbers.Integral)
+    if name == 'Mult':
+        for count, value in ((left, right), (right, left)):
+            if isinstance(count, numbers.Integral) and hasattr(value, '__len__') and count * len(value) > MAX_SIZE:
+                raise NotConstant()
+        if integers and left.bit_length() + right.bit_length() > MAX_BITS:
+            raise NotConstant()
+        return left * right
+    if name == 'Pow':
+        if integers and right > 0 and left.bit_length() * right > MAX_BITS:
+            raise NotConstant()
+        return left ** right
+    if integers and right > MAX_BITS:
+        raise NotConstant()
+    return left << right
+
+
+def check_size(value):
+    """Raises NotConstant if a value computed while folding is too big to keep"""
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool) and value.bit_length() > MAX_BITS:
+        raise NotConstant()
+    if isinstance(value, (str, text_type, bytes, list, tuple, dict, set)) and len(value) > MAX_SIZE:
+        raise NotConstant()
+    return value
+
+
+class GuardOperations(ast.NodeTransformer):
+    """Rewrites multiplications, powers and shifts into calls checking the size of their result"""
+
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        name = node.op.__class__.__name__
+        if name not in ('Mult', 'Pow', 'LShift'):
+            return node
+        call = ast.Call(func=ast.Name(id='__operation', ctx=ast.Load()),
+                        args=[ast.Str(s=name) if sys.version_info < (3, 8) else ast.Constant(value=name),
+                              node.left, node.right], keywords=[])
+        if sys.version_info < (3, 5):
+            call.starargs = call.kwargs = None
+        return ast.copy_location(call, node)
+
+
+class Folder(object):
+    """Folds the constant regions of the template functions of a module"""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.segments = None
+        self.values = []
+        self.segment_index = dict()
+        # The code of each expression evaluated, by the id of its node
+        self.code = dict()
+        self.folded = 0
+        # The calls folded in the function at hand, less the names it rebinds
+        self.calls = CONSTANT_CALLS
+
+    def fold(self):
+        """Folds the module in place, returns the number of regions folded"""
+        for node in self.tree.body:
+            if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == '__segments':
+                self.segments = node.value
+        if self.segments is None:
+            return 0
+        self.values = [ast.literal_eval(element) for element in self.segments.elts]
+        for index, value in enumerate(self.values):
+            self.segment_index.setdefault(value, index)
+        for node in self.tree.body:
+            if isinstance(node, ast.FunctionDef):
+                bound = bound_names(node)
+                self.calls = dict((name, call) for name, call in CONSTANT_CALLS.items() if name not in bound)
+                self.code.clear()
+                node.body = self.fold_body(node.body)
+        return self.folded
+
+    def fold_body(self, body):
+        folded = self.folded
+        result = []
+        for node in body:
+            result.extend(self.fold_statement(node))
+        if self.folded != folded:
+            result = self.merge_writes(result)
+        if not result and body:
+            # A block may not be empty
+            result.append(ast.copy_location(ast.Pass(), body[0]))
+        return result
+
+    def merge_writes(self, body):
+        """
+    Merges the writes of consecutive segments into one.  Assignments of
+    literals and checks for a full chunk between them are moved after it.
+    """
+        result = []
+        texts = []
+        held = []
+        flush = None
+        for node in body + [None]:
+            index = self.written_segment(node)
+            if index is not None:
+                if not texts:
+                    first = node
+                texts.append(self.values[index])
+                continue
+            if texts and self.is_literal_assignment(node):
+                held.append(node)
+                continue
+            if texts and isinstance(node, ast.If) and self.is_flush(node):
+                flush = node
+                continue
+            if texts:
+                if len(texts) > 1:
+                    first = self.write(u"".join(texts), first)
+                result.append(first)
+                result.extend(held)
+                if flush is not None:
+                    result.append(flush)
+                texts = []
+                held = []
+                flush = None
+            if node is not None:
+                result.append(node)
+        return result
+
+    @staticmethod
+    def written_segment(node):
+        """Returns the index of the segment a statement writes or None if it is not such a write"""
+        if not isinstance(node, ast.Expr) or not isinstance(node.value, ast.Call):
+            return None
+        call = node.value
+        if getattr(call.func, 'id', None) != '__write' or len(call.args) != 1:
+            return None
+        argument = call.args[0]
+        if not isinstance(argument, ast.Subscript) or getattr(argument.value, 'id', None) != '__s':
+            return None
+        index = argument.slice
+        if hasattr(ast, 'Index') and isinstance(index, ast.Index):
+            index = index.value
+        try:
+            return ast.literal_eval(index)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def is_literal_assignment(node):
+        if not isinstance(node, ast.Assign) or not all(isinstance(target, ast.Name) for target in node.targets):
+            return False
+        try:
+            ast.literal_eval(node.value)
+        except ValueError:
+            return False
+        return True
+
+    def write(self, text, node):
+        """Returns a statement writing text located at node"""
+        write = ast.Expr(value=ast.Call(
+            func=ast.Name(id='__write', ctx=ast.Load()),
+            args=[ast.Subscript(value=ast.Name(id='__s', ctx=ast.Load()),
+                                slice=self.index(self.segment(text)), ctx=ast.Load())],
+            keywords=[]))
+        ast.copy_location(write, node)
+        ast.fix_missing_locations(write)
+        return write
+
+    def fold_statement(self, node):
+        """Returns the statements replacing a statement"""
+        if isinstance(node, (ast.If, ast.For)):
+            try:
+                env = dict()
+                output = []
+                self.run([node], env, output, [0])
+                return self.replacement(node, output, env)
+            except NotConstant:
+                pass
+            except Exception:
+                # Evaluating raised, the error is left to the render
+                pass
+        if isinstance(node, ast.If):
+            try:
+                test = self.evaluate(node.test, {})
+            except Exception:
+                pass
+            else:
+                self.folded += 1
+                return self.fold_body(node.body if test else node.orelse)
+        for field in ('body', 'orelse', 'finalbody'):
+            if isinstance(getattr(node, field, None), list) and not isinstance(node, ast.FunctionDef):
+                setattr(node, field, self.fold_body(getattr(node, field)))
+        return [node]
+
+    def replacement(self, node, output, env):
+        """Returns a write of the output of a folded region and assignments of the names it bound"""
+        text = u"".join(output)
+        if len(text) > MAX_SIZE:
+            raise NotConstant()
+        statements = []
+        for name in sorted(env):
+            if name.startswith('__'):
+                continue
+            value = self.literal(env[name])
+            statements.append(ast.Assign(targets=[ast.Name(id=name, ctx=ast.Store())], value=value))
+        if text:
+            statements.insert(0, self.write(text, node))
+        for statement in statements:
+            ast.copy_location(statement, node)
+            ast.fix_missing_locations(statement)
+        self.folded += 1
+        return statements
+
+    @staticmethod
+    def literal(value):
+        """Returns an expression node building value, NotConstant if repr does not round trip"""
+        try:
+            node = ast.parse(repr(value), mode='eval').body
+            same = ast.literal_eval(node) == value and type(ast.literal_eval(node)) is type(value)
+        except (SyntaxError, ValueError):
+            same = False
+        if not same:
+            raise NotConstant()
+        return node
+
+    @staticmethod
+    def index(value):
+        node = ast.parse(repr(value), mode='eval').body
+        if sys.version_info < (3, 9):
+            return ast.Index(value=node)
+        return node
+
+    def segment(self, text):
+        """Returns the index of a segment, adding it to __segments when it is new"""
+        index = self.segment_index.get(text)
+        if index is None:
+            index = self.segment_index[text] = len(self.segments.elts)
+            self.segments.elts.append(self.literal(text))
+            self.values.append(text)
+        return index
+
+    def evaluate(self, node, env):
+        check_expression(node, env, self.calls)
+        code = self.code.get(id(node))
+        if code is None:
+            expression = ast.Expression(body=GuardOperations().visit(copy.deepcopy(node)))
+            ast.fix_missing_locations(expression)
+            code = self.code[id(node)] = compile(expression, '<fold>', 'eval')
+        names = dict(self.calls)
+        names.update(env)
+        names['__operation'] = guarded_operation
+        return check_size(eval(code, {'__builtins__': {}}, names))
+
+    def run(self, body, env, output, steps):
+        """Runs statements appending what they write to output, raises NotConstant if it can not"""
+        for node in body:
+            steps[0] += 1
+            if steps[0] > MAX_STEPS:
+                raise NotConstant()
+            if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and \
+                    getattr(node.value.func, 'id', None) == '__write' and len(node.value.args) == 1:
+                names = dict(env)
+                names['__s'] = self.values
+                value = self.evaluate(node.value.args[0], names)
+                if not isinstance(value, text_type) and not isinstance(value, str):
+                    raise NotConstant()
+                output.append(value)
+            elif isinstance(node, ast.Assign):
+                value = self.evaluate(node.value, env)
+                for target in node.targets:
+                    self.bind(target, value, env)
+            elif isinstance(node, ast.If):
+                if self.is_flush(node):
+                    continue
+                self.run(node.body if self.evaluate(node.test, env) else node.orelse, env, output, steps)
+            elif isinstance(node, ast.For) and not node.orelse:
+                for value in self.evaluate(node.iter, env):
+                    self.bind(node.target, value, env)
+                    self.run(node.body, env, output, steps)
+                    steps[0] += 1
+                    if steps[0] > MAX_STEPS:
+                        raise NotConstant()
+            elif not isinstance(node, ast.Pass):
+                raise NotConstant()
+
+    @staticmethod
+    def is_flush(node):
+        """Returns whether a statement hands a full chunk out, which is dropped in a folded region"""
+        test = node.test
+        return isinstance(test, ast.Attribute) and test.attr == 'full' and \
+            getattr(test.value, 'id', None) == '__io'
+
+    def bind(self, target, value, env):
+        if isinstance(target, ast.Name):
+            env[target.id] = value
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            values = tuple(value)
+            if len(values) != len(target.elts):
+                raise NotConstant()
+            for element, item in zip(target.elts, values):
+                self.bind(element, item, env)
+        else:
+            raise NotConstant()
+
+
+def fold_constants(tree):
+    """Folds the constant regions of a parsed template module in place, returns how many were folded"""
+    return Folder(tree).fold()
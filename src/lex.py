@@ -14,7 +14,9 @@ class Token:
     MULTILINE = "MULTILINE"
     EXPLICITMULTILINEEND = "EXPLICITMULTILINEEND"
     PARENEXPRESSION = "PARENEXPRESSION"
+    RAWPARENEXPRESSION = "RAWPARENEXPRESSION"
     EXPRESSION = "EXPRESSION"
+    RAWEXPRESSION = "RAWEXPRESSION"
     TEXT = "TEXT"
     CODE = "CODE"
     NEWLINE = "NEWLINE"
@@ -27,9 +29,84 @@ class Token:
     PRINTLINE = "PRINTLINE"
 
 
-def bind(handler):
-    """Simple binding function"""
-    return lambda scanner, token: handler(scanner, token);
+# Matches the same tokens as the rule [^@]+/>[ \t]* which rescans the input up
+# to the next @ at every position it is tried
+XMLSELFCLOSE = r"[^@]+/>[ \t]*"
+
+TEXT_START = re.compile("[ \t]*<text>")
+TEXT_END = re.compile("[ \t]*</text>")
+PRINT_LINE = re.compile("([ \t]*print[ \t]*[(][ \t]*['\"])(.*)([\"'][ \t]*[)])")
+
+BRACKET = re.compile(r"[()\[\]{}'\"\n]")
+OPENING = "([{"
+CLOSING = ")]}"
+
+
+def match_brackets(input, position):
+    """
+  Returns the position just past the bracket closing an expression opened
+  before position or -1 if the line ends first.  Brackets inside string
+  literals are skipped.  The input is searched in place so long templates are
+  never copied.
+  """
+    level = 1
+    while True:
+        match = BRACKET.search(input, position)
+        if match is None:
+            return -1
+        c = match.group()
+        position = match.end()
+        if c in OPENING:
+            level += 1
+        elif c in CLOSING:
+            level -= 1
+            if level == 0:
+                return position
+        elif c == "\n":
+            # Halt at new line
+            return -1
+        else:
+            # Skip to the end of the string literal
+            while True:
+                end = input.find(c, position)
+                if end < 0 or input.find("\n", position, end) >= 0:
+                    return -1
+                position = end + 1
+                backslashes = 0
+                while input[end - 1 - backslashes] == "\\":
+                    backslashes += 1
+                if backslashes % 2 == 0:
+                    break
+
+
+class SelfCloseMatcher(object):
+    """
+  Matches XMLSELFCLOSE in linear time.  The greedy [^@]+ ends at the last />
+  before the next @, so the position of that @ and of the last /> before it
+  are found once and reused for every position up to the @.
+  """
+
+    def __init__(self):
+        self.input = None
+        self.start = 0
+        self.at = -1
+        self.close = -1
+
+    def match(self, input, position):
+        if input is not self.input or position < self.start or position > self.at:
+            at = input.find('@', position)
+            if at < 0:
+                at = len(input)
+            self.input = input
+            self.start = position
+            self.at = at
+            self.close = input.rfind('/>', position, at)
+        if self.close <= position:
+            return -1
+        end = self.close + 2
+        while end < self.at and input[end] in ' \t':
+            end += 1
+        return end
 
 
 class RazorLexer(object):
@@ -39,32 +116,36 @@ class RazorLexer(object):
     def create(ignore_whitespace=False):
         """Creates the rules bound to a new lexer instance"""
         lex = RazorLexer(ignore_whitespace)
+        matcher = SelfCloseMatcher()
         lex.rules = (
-            (Token.NEWLINE, (r"[\r]?[\n][ \t]*", bind(lex.new_line))),
-            (Token.ESCAPED, (r"@@", bind(lex.escaped))),
-            (Token.LINECOMMENT, (r"@#[^\n]*?$", bind(lex.line_comment))),
-            (Token.ONELINE, (r"@(?:import|from|model) .+$", bind(lex.one_line))),
-            (Token.MULTILINE, (r"@\w*.*:$", bind(lex.multiline))),
-            (Token.PARENEXPRESSION, (r"@!?\(", bind(lex.paren_expression))),
+            (Token.NEWLINE, (r"[\r]?[\n][ \t]*", lex.new_line)),
+            (Token.ESCAPED, (r"@@", lex.escaped)),
+            (Token.LINECOMMENT, (r"@#[^\n]*?$", lex.line_comment)),
+            (Token.ONELINE, (r"@(?:import|from|model) .+$", lex.one_line)),
+            (Token.MULTILINE, (r"@\w*.*:$", lex.multiline)),
+            (Token.RAWPARENEXPRESSION, (r"@!\(", lex.paren_expression)),
+            (Token.PARENEXPRESSION, (r"@\(", lex.paren_expression)),
+            (Token.RAWEXPRESSION,
+             (r"@!(\w+(?:(?:\[.+\])|(?:\(.*\)))?(?:\.[a-zA-Z]+(?:(?:\[.+\])|(?:\(.*\)))?)*)", lex.expression)),
             (Token.EXPRESSION,
-             (r"@!?(\w+(?:(?:\[.+\])|(?:\(.*\)))?(?:\.[a-zA-Z]+(?:(?:\[.+\])|(?:\(.*\)))?)*)", bind(lex.expression))),
-            (Token.XMLFULLSTART, (r"[ \t]*<\w[^@\n]*?>", bind(lex.xml_start))),
-            (Token.XMLSTART, (r"[ \t]*<\w[^@\n>]*", bind(lex.xml_start))),
-            (Token.XMLEND, (r"[ \t]*</[^@\n]+[>]", bind(lex.xml_end))),
-            (Token.XMLSELFCLOSE, (r"[^@]+/>[ \t]*", bind(lex.xml_self_close))),
-            (Token.TEXT, (r"[^@\n<]+", bind(lex.text))),
+             (r"@(\w+(?:(?:\[.+\])|(?:\(.*\)))?(?:\.[a-zA-Z]+(?:(?:\[.+\])|(?:\(.*\)))?)*)", lex.expression)),
+            (Token.XMLFULLSTART, (r"[ \t]*<\w[^@\n]*?>", lex.xml_start)),
+            (Token.XMLSTART, (r"[ \t]*<\w[^@\n>]*", lex.xml_start)),
+            (Token.XMLEND, (r"[ \t]*</[^@\n]+[>]", lex.xml_end)),
+            (Token.XMLSELFCLOSE, (matcher, lex.xml_self_close)),
+            (Token.TEXT, (r"[^@\n<]+", lex.text)),
         )
         lex.multilineRules = (
-            (Token.EMPTYLINE, (r"[\r]?[\n][ \t]*$", bind(lex.empty_line))),
-            (Token.EXPLICITMULTILINEEND, (r"[\r]?[\n][ \t]*\w*.*:@", bind(lex.multiline_end))),
-            (Token.NEWLINE, (r"[\r]?[\n][ \t]*", bind(lex.new_line))),
-            (Token.XMLFULLSTART, (r"[ \t]*<\w[^@\n]*?>", bind(lex.xml_start))),
-            (Token.XMLSTART, (r"[ \t]*<\w[^@\n>]*", bind(lex.xml_start))),
-            (Token.XMLEND, (r"[ \t]*</[^@\n]+[>]", bind(lex.xml_end))),
-            (Token.XMLSELFCLOSE, (r"[^@]+/>[ \t]*", bind(lex.xml_self_close))),
-            (Token.MULTILINE, (r"\w*.*:$", bind(lex.multiline))),
-            (Token.PRINTLINE, (r"[ \t]*print[ \t]*[(][ \t]*['\"].*[\"'][ \t]*[)]", bind(lex.print_line))),
-            (Token.CODE, (r".+", bind(lex.code))),
+            (Token.EMPTYLINE, (r"[\r]?[\n][ \t]*$", lex.empty_line)),
+            (Token.EXPLICITMULTILINEEND, (r"[\r]?[\n][ \t]*\w*.*:@", lex.multiline_end)),
+            (Token.NEWLINE, (r"[\r]?[\n][ \t]*", lex.new_line)),
+            (Token.XMLFULLSTART, (r"[ \t]*<\w[^@\n]*?>", lex.xml_start)),
+            (Token.XMLSTART, (r"[ \t]*<\w[^@\n>]*", lex.xml_start)),
+            (Token.XMLEND, (r"[ \t]*</[^@\n]+[>]", lex.xml_end)),
+            (Token.XMLSELFCLOSE, (matcher, lex.xml_self_close)),
+            (Token.MULTILINE, (r"\w*.*:$", lex.multiline)),
+            (Token.PRINTLINE, (r"[ \t]*print[ \t]*[(][ \t]*['\"].*[\"'][ \t]*[)]", lex.print_line)),
+            (Token.CODE, (r".+", lex.code)),
         )
         lex.lexer = sexylexer.Lexer(lex.rules, lex.multilineRules)
         return lex
@@ -81,6 +162,20 @@ class RazorLexer(object):
             return self.lexer.scan(text.lstrip())
         return self.lexer.scan(text)
 
+    def checkpoint(self, scanner):
+        """Returns the state of the lexer at a top level line or None elsewhere"""
+        if self.Mode or scanner.Mode != sexylexer.ScannerMode.Text:
+            return None
+        indentation = self.scope.checkpoint()
+        if indentation is None:
+            return None
+        return indentation, self.NewLine
+
+    def restore(self, state):
+        """Restores the state returned by checkpoint"""
+        indentation, self.NewLine = state
+        self.scope.restore(indentation)
+
     # Token Parsers
     @staticmethod
     def should_escape(token):
@@ -90,54 +185,40 @@ class RazorLexer(object):
     def xml_start(self, scanner, token):
         self.push_mode(scanner)
         scanner.Mode = sexylexer.ScannerMode.Text
-        token = re.sub("[ \t]*<text>", "", token)
+        if "<text>" in token:
+            token = TEXT_START.sub("", token)
         if self.NewLine:
             self.NewLine = False
-            return self.scope.indentstack.get_scope_indentation()[0] + token.replace("'", "\\'")
-        return token.replace("'", "\\'")
+            return self.scope.indentstack.get_scope_indentation()[0] + token
+        return token
 
     def xml_end(self, scanner, token):
         self.pop_mode(scanner)
-        token = re.sub("[ \t]*</text>", "", token)
+        if "</text>" in token:
+            token = TEXT_END.sub("", token)
         if self.NewLine:
             self.NewLine = False
-            return self.scope.indentstack.get_scope_indentation()[0] + token.replace("'", "\\'")
-        return token.replace("'", "\\'")
+            return self.scope.indentstack.get_scope_indentation()[0] + token
+        return token
 
     def xml_self_close(self, scanner, token):
         self.pop_mode(scanner)
         if self.NewLine:
             self.NewLine = False
-            return self.scope.indentstack.get_scope_indentation()[0] + token.replace("'", "\\'")
-        return token.replace("'", "\\'")
+            return self.scope.indentstack.get_scope_indentation()[0] + token
+        return token
 
     def paren_expression(self, scanner, token):
         """Performs paren matching to find the end of a parenthesis expression"""
         start = scanner._position
-        plevel = 1
-        end = start
-        for c in scanner.input[start:]:
-            if plevel == 0:
-                # Halt when we close our braces
-                break;
-            elif c == '(':
-                plevel += 1
-            elif c == ')':
-                plevel -= 1
-            elif c == '\n':
-                # Halt at new line
-                break
-            end += 1
+        end = match_brackets(scanner.input, start)
         # parse exception
-        if plevel != 0:
+        if end < 0:
             raise sexylexer.InvalidTokenError()
         scanner._position = end
 
-        # Our token here is either @!( or @(
-        if not self.should_escape(token):
-            return scanner.input[start:end - 1]
-        # We wrap the expression in a call to cgi.escape
-        return "cgi.escape(str(" + scanner.input[start:end - 1] + "))"
+        # Our token here is either @!( or @(, the builder escapes the latter
+        return scanner.input[start:end - 1]
 
     def multiline(self, scanner, token):
         """Handles multiline expressions"""
@@ -175,7 +256,7 @@ class RazorLexer(object):
     def expression(self, scanner, token):
         if not self.should_escape(token):
             return token[2:]
-        return "cgi.escape(str(" + token[1:] + "))"
+        return token[1:]
 
     def one_line(self, scanner, token):
         lower_token = token.lower()
@@ -191,12 +272,12 @@ class RazorLexer(object):
         return None
 
     def text(self, scanner, token):
-        """Returns text escaped with ' escaped"""
-        return token.replace("'", "\\'")
+        """Returns view text"""
+        return token
 
     def print_line(self, scanner, token):
         self.pop_mode(scanner)
-        token = re.match("([ \t]*print[ \t]*[(][ \t]*['\"])(.*)([\"'][ \t]*[)])", token).group(2)
+        token = PRINT_LINE.match(token).group(2)
         if self.NewLine:
             self.NewLine = False
             return self.scope.indentstack.get_scope_indentation()[0] + token
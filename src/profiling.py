@@ -0,0 +1,185 @@
+# Collects timings of parsing, compiling and rendering views
+#
+# A Profiler is installed by PyRazor.enable_profiling which wraps the render
+# methods of that engine, nothing is measured and nothing is wrapped while it
+# is disabled.  Views compiled while profiling are numbered by the lines of
+# their template file so tracebacks, cProfile and the line timings point at
+# template lines.
+
+import linecache
+import sys
+import threading
+import time
+
+timer = getattr(time, 'perf_counter', time.time)
+
+
+class TemplateStats(object):
+    """The counters of one template, renders are also counted by kind"""
+
+    def __init__(self, name):
+        self.name = name
+        self.parses = 0
+        self.parse_time = 0.0
+        self.compile_time = 0.0
+        self.renders = 0
+        self.render_time = 0.0
+        self.bytes = 0
+        self.kinds = dict()
+
+
+class Profiler(object):
+    """
+  Records the parse, compile and render times of each template and the size
+  of its output.  Renders are of the kind render, tmpl for partials, layout
+  or stream.  Render times include the partials and layouts rendered within.
+  Override on_parse and on_render to hook into the events.
+
+  @param lines  also time every template line, this traces the renders
+  """
+
+    def __init__(self, lines=False):
+        self.templates = dict()
+        self.lines = dict() if lines else None
+        self.filenames = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def get_stats(self, name):
+        stats = self.templates.get(name)
+        if stats is None:
+            stats = self.templates[name] = TemplateStats(name)
+        return stats
+
+    def on_parse(self, name, filename, parse_time, compile_time):
+        """Called when a template was parsed and compiled"""
+        with self._lock:
+            self.filenames.add(filename)
+            stats = self.get_stats(name)
+            stats.parses += 1
+            stats.parse_time += parse_time
+            stats.compile_time += compile_time
+
+    def on_render(self, name, kind, seconds, size):
+        """Called when a template was rendered, size is None when it is unknown"""
+        with self._lock:
+            stats = self.get_stats(name)
+            stats.renders += 1
+            stats.render_time += seconds
+            stats.bytes += size or 0
+            stats.kinds[kind] = stats.kinds.get(kind, 0) + 1
+
+    def instrument(self, method, kind, name_arg=None, io_arg=None, stream=False):
+        """
+    Wraps a render method of PyRazor.  name_arg is the index of the view
+    name argument, text templates are named <string>, and io_arg the index of
+    the io written to, otherwise the output is returned.  With stream set the
+    method returns a generator of chunks.
+    """
+        if stream:
+            return self._instrument_stream(method, kind, name_arg)
+
+        def render(*args, **kwargs):
+            name = args[name_arg] if name_arg is not None else '<string>'
+            io = args[io_arg] if io_arg is not None else None
+            position = output_size(io)
+            tracer = self._trace_start()
+            start = timer()
+            try:
+                value = method(*args, **kwargs)
+            finally:
+                seconds = timer() - start
+                self._trace_stop(tracer)
+            if io is None:
+                size = output_length(value)
+            elif position is not None:
+                size = output_size(io) - position
+            else:
+                size = None
+            self.on_render(name, kind, seconds, size)
+            return value
+
+        return render
+
+    def _instrument_stream(self, method, kind, name_arg):
+        def stream(*args, **kwargs):
+            name = args[name_arg] if name_arg is not None else '<string>'
+            seconds = 0.0
+            size = 0
+            start = timer()
+            chunks = method(*args, **kwargs)
+            for chunk in chunks:
+                seconds += timer() - start
+                size += len(chunk)
+                yield chunk
+                start = timer()
+            seconds += timer() - start
+            self.on_render(name, kind, seconds, size)
+
+        return stream
+
+    def _trace_start(self):
+        """Starts tracing template lines unless a render of this thread already did"""
+        if self.lines is None or getattr(self._local, 'tracer', None) is not None:
+            return None
+        tracer = self._local.tracer = (sys.gettrace(),)
+        self._local.line = None
+        sys.settrace(self._trace)
+        return tracer
+
+    def _trace_stop(self, tracer):
+        if tracer is not None:
+            self._trace_line(None, 'return', None)
+            sys.settrace(tracer[0])
+            self._local.tracer = None
+
+    def _trace(self, frame, event, arg):
+        if frame.f_code.co_filename in self.filenames:
+            return self._trace_line
+        return None
+
+    def _trace_line(self, frame, event, arg):
+        # The time since the last line event is spent by that line, this
+        # includes the functions it called which are not templates
+        now = timer()
+        local = self._local
+        if local.line is not None:
+            self.lines[local.line] = self.lines.get(local.line, 0.0) + now - local.since
+        if event == 'line':
+            local.line = (frame.f_code.co_filename, frame.f_lineno)
+            local.since = now
+        else:
+            local.line = None
+        return self._trace_line
+
+    def report(self):
+        """Returns a table of the templates by the time spent rendering them"""
+        lines = ["%-40s %8s %10s %10s %8s %10s %10s" % (
+            "template", "renders", "render ms", "bytes", "parses", "parse ms", "compile ms")]
+        for stats in sorted(self.templates.values(), key=lambda stats: -stats.render_time):
+            lines.append("%-40s %8d %10.3f %10d %8d %10.3f %10.3f" % (
+                stats.name, stats.renders, stats.render_time * 1000, stats.bytes, stats.parses,
+                stats.parse_time * 1000, stats.compile_time * 1000))
+        return "\n".join(lines)
+
+    def line_report(self, limit=20):
+        """Returns a table of the slowest template lines"""
+        lines = []
+        for (filename, lineno), seconds in sorted(self.lines.items(), key=lambda item: -item[1])[:limit]:
+            lines.append("%10.3f ms  %s:%d  %s" % (seconds * 1000, filename, lineno,
+                                                   linecache.getline(filename, lineno).strip()))
+        return "\n".join(lines)
+
+
+def output_length(value):
+    """Returns the length of rendered output, which may be a list of parts"""
+    if value.__class__ is list:
+        return sum(map(len, value))
+    return len(value)
+
+
+def output_size(io):
+    """Returns the number of characters written to io or None if it can not tell"""
+    if io is None or not hasattr(io, 'tell'):
+        return None
+    return io.tell()
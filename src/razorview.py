@@ -1,73 +1,493 @@
 # Alex Lusco
 
+import ast
 import logging
 import re
-import types
 import hashlib
+import marshal
+import multiprocessing
 import os
 import os.path
-from io import StringIO
+import threading
+import time
+import types
+from io import BytesIO, StringIO
 
 import lex
-import cgi
+from cache import BytecodeCache, FragmentCache, LRUCache
+from escape import encoded_escape, encoded_text, escape, text_type
+from folding import fold_constants, has_candidates
+from profiling import Profiler, timer
+
+__version__ = '0.1.10'
+
+EXTENSIONS = ('.pyhtml',)
+
+COMMENT = re.compile("@#.*#@", re.S)
+
+# A for loop, rewritten into an async for loop in the async variant
+FOR_LOOP = re.compile(r"for\s+(.+?)\s+in\s+(.+?)\s*:\s*$")
+
+# Calls naming a partial or layout by a string literal
+DEPENDENCY = re.compile(r"""\bview\.(tmpl|wrap|fragment)\(\s*[uUrR]?(['"])([^'"\\]+)\2""")
+
+# Code which may set a layout: wrap itself, the view escaping into a call or
+# an assignment where wrap can be reached through it, or introspection
+MAY_WRAP = re.compile(r"\b(?:wrap|getattr|locals|vars|eval|exec)\b|\b(?:view|self)\b(?!\s*\.\s*[a-zA-Z_])")
+
+# The render methods wrapped while profiling with their kind, the index of the
+# view name argument and of the io argument
+PROFILED = (
+    ('render', 'render', None, None),
+    ('render_file', 'render', 0, None),
+    ('render_file_to', 'tmpl', 1, 0),
+    ('render_layout', 'layout', 0, None),
+    ('render_layout_to', 'layout', 1, 0),
+    ('render_segments', 'render', None, None),
+    ('render_file_segments', 'render', 0, None),
+    ('render_bytes', 'render', None, None),
+    ('render_file_bytes', 'render', 0, None),
+    ('render_file_bytes_to', 'render', 1, 0),
+    ('stream', 'stream', None, None),
+    ('stream_file', 'stream', 0, None),
+    ('stream_layout', 'layout', 0, None),
+)
 
 
 class View(object):
-    """A razor view"""
+    """A compiled razor view.
 
-    def __init__(self, razor, text, ignore_whitespace, path):
+  A view holds no render state, everything a render needs lives in the
+  ViewContext it creates so one view can be rendered by many threads at once.
+  template is the template text or a template function compiled from it.
+  """
+
+    def __init__(self, razor, template, ignore_whitespace, path):
         self.razor = razor
         self.path = os.path.dirname(path)
         self.ignore_whitespace = ignore_whitespace
-        self.__layout = None
-        self.__layoutModel = None
-        self._value = ''
-        self._body = ''
-        self._sections = dict()
-        self.renderer = types.MethodType(self.parse(text, ignore_whitespace), self)
+        if isinstance(template, (str, text_type)):
+            template = View.parse(template, ignore_whitespace)
+        self.template = template
+        # Modules compiled by older versions only have the template function
+        self.stream_template = getattr(template, 'stream', None)
+        # Only views compiled with PyRazor.Asynchronous set have a coroutine variant
+        self.async_template = getattr(template, 'async_template', None)
+        self.wraps = getattr(template, 'wraps', True)
+        # The names of the views this view renders or is wrapped in
+        self.dependencies = tuple(self.layout_path(target) if kind == 'wrap' else target
+                                  for kind, target in getattr(template, 'dependencies', ()))
+        # Template functions writing pre-encoded segments, by encoding
+        self.encoded_templates = dict()
+
+    def layout_path(self, path):
+        """Returns the name of a layout given relative to this view"""
+        if not os.path.isabs(path):
+            path = os.path.join(self.path, path)
+        return path
+
+    def get_size(self):
+        """Returns the approximate number of bytes held by the compiled view"""
+        return len(marshal.dumps(self.template.__code__))
 
-    def render(self, model=None):
+    def render(self, model=None, body=''):
         io = StringIO()
-        self.render_to(io, model)
-        self._value = io.getvalue()
+        self.render_to(io, model, body)
+        value = io.getvalue()
         io.close()
-        if self.__layout is not None:
-            self._value = self.razor.render_layout(self.__layout, self._value, self.__layoutModel, self.ignore_whitespace)
-        return self._value
+        return value
 
-    def render_to(self, io, model=None):
-        self.model = model
+    def render_to(self, io, model=None, body=''):
+        """Renders the view and its layout into io"""
+        if not self.wraps:
+            self.check_layout(self._render(io, model, body))
+            return
+
+        # The layout is only known once the view is rendered so its output is
+        # held back in a buffer of the same kind as io
+        if io.__class__ is EncodedIO:
+            target = SegmentIO(b'') if io.target.__class__ is SegmentIO else BytesIO()
+            buffer = EncodedIO(target, io.encoding)
+        elif io.__class__ is SegmentIO:
+            buffer = SegmentIO()
+        else:
+            buffer = StringIO()
+        self._render_wrapped(io, buffer, model, body)
+        buffer.close()
+
+    def render_segments(self, model=None, encoding=None):
+        """
+    Renders the view into the list of the strings it wrote, or of bytes when
+    an encoding is given.  Static text is not copied, the list can be joined
+    or handed to a WSGI server or socket.sendmsg as it is.
+    """
+        if encoding is None:
+            io = SegmentIO()
+            self.render_to(io, model)
+        else:
+            io = SegmentIO(b'')
+            self.render_to(EncodedIO(io, encoding), model)
+        return io.parts
+
+    def render_bytes(self, model=None, encoding='utf-8'):
+        """Renders the view into encoded bytes"""
+        target = BytesIO()
+        self.render_bytes_to(target, model, encoding)
+        return target.getvalue()
+
+    def render_bytes_to(self, target, model=None, encoding='utf-8', body=''):
+        """Renders the view and its layout encoded into a bytearray or a binary file like object"""
+        self.render_to(EncodedIO(target, encoding), model, body)
+
+    def _render_wrapped(self, io, buffer, model, body):
+        """Renders the view into the empty buffer then its layout into io"""
+        context = self._render(buffer, model, body)
+        # Segment buffers pass on their parts so nothing is copied
+        target = buffer.target if buffer.__class__ is EncodedIO else buffer
+        value = target.parts if target.__class__ is SegmentIO else buffer.getvalue()
+        if context.layout is None:
+            write_all(io, value)
+        else:
+            self.razor.render_layout_to(io, context.layout, value, context.layout_model,
+                                        self.ignore_whitespace)
+
+    def render_many(self, models, sink):
+        """Renders the view once per model passing each output to sink, the buffers are reused"""
+        io = StringIO()
+        buffer = StringIO() if self.wraps else None
+        for model in models:
+            if buffer is None:
+                self.check_layout(self._render(io, model, ''))
+            else:
+                self._render_wrapped(io, buffer, model, '')
+                buffer.seek(0)
+                buffer.truncate()
+            sink(io.getvalue())
+            io.seek(0)
+            io.truncate()
+        io.close()
+
+    def _render(self, io, model, body):
+        """Renders the view into io and returns the context of the render"""
+        context = ViewContext(self, io, model, body)
+        if io.__class__ is EncodedIO:
+            template = self.encoded_templates.get(io.encoding) or self.encode_template(io.encoding)
+            template(context, io, model)
+        else:
+            self.template(context, io, model)
+        return context
+
+    def encode_template(self, encoding):
+        """
+    Returns a copy of the template function writing to an EncodedIO.  Its
+    static segments are encoded once here, only the expressions are encoded
+    while rendering.
+    """
+        template = self.template
+        code = template.__code__
+        if code.co_varnames[code.co_argcount - 3:code.co_argcount] == ('__s', '__escape', '__text'):
+            segments = tuple(segment.encode(encoding) if isinstance(segment, text_type) else segment
+                             for segment in template.__defaults__[-3])
+            defaults = template.__defaults__[:-3] + (segments, encoded_escape(encoding), encoded_text(encoding))
+            encoded = types.FunctionType(code, template.__globals__, template.__name__, defaults,
+                                         template.__closure__)
+        else:
+            # Modules compiled by older versions write text, it is encoded as a whole
+            def encoded(context, io, model):
+                body = context._body
+                if body.__class__ is list:
+                    body = b''.join(body)
+                if isinstance(body, bytes):
+                    context._body = body.decode(encoding)
+                buffer = context.io = StringIO()
+                template(context, buffer, model)
+                io.write(buffer.getvalue().encode(encoding))
+        self.encoded_templates[encoding] = encoded
+        return encoded
+
+    def stream(self, model=None, chunk_size=8192, body=''):
+        """Renders the view yielding its output in chunks of about chunk_size characters"""
+        if self.wraps or self.stream_template is None:
+            # The layout is only known once the view is rendered so the view
+            # itself is rendered up front and its layout is streamed
+            io = StringIO()
+            context = self._render(io, model, body)
+            value = io.getvalue()
+            io.close()
+            if context.layout is None:
+                yield value
+            else:
+                for chunk in self.razor.stream_layout(context.layout, value, context.layout_model,
+                                                      self.ignore_whitespace, chunk_size):
+                    yield chunk
+            return
+
+        io = StreamIO(chunk_size)
+        context = ViewContext(self, io, model, body)
+        for chunk in self.stream_template(context, io, model):
+            if chunk:
+                yield chunk
+        self.check_layout(context)
+
+    def check_layout(self, context):
+        """Raises if a render which was not held back set a layout, its output would go out without it"""
+        if context.layout is not None:
+            raise RuntimeError("The view set a layout in a way the compiler did not see, "
+                               "call view.wrap in the template itself")
+
+    @staticmethod
+    def parse(text, ignore_whitespace, asynchronous=False):
+        """Parses the template text into a template function"""
+        return ViewBuilder.load(View.compile(text, ignore_whitespace, asynchronous))
+
+    @staticmethod
+    def compile(text, ignore_whitespace, asynchronous=False):
+        """Parses the template text into a code object"""
+        return View.generate(text, ignore_whitespace, asynchronous).compile()
+
+    @staticmethod
+    def strip_comments(text):
+        """Removes @# ... #@ comments from the template text"""
+        return COMMENT.sub("", text)
+
+    @staticmethod
+    def generate(text, ignore_whitespace, asynchronous=False):
+        """Parses the template text into a ViewBuilder holding the generated code"""
+        source = SourceLines(text, ignore_whitespace)
+        lexer = lex.RazorLexer.create(ignore_whitespace)
+        builder = ViewBuilder(lexer.scope, asynchronous)
+        scanner = lexer.lexer.scan(source.text)
+        for token in scanner:
+            builder.set_line(source.line(scanner.token_position()[0], scanner.start))
+            builder.parse(token)
+        return builder
+
+
+class SourceLines(object):
+    """
+  Prepares template text for the lexer and maps the lines of the prepared
+  text back to the lines of the template.  Comments are removed and with
+  ignore_whitespace the leading whitespace is stripped, the lexer never sees
+  either.
+  """
+
+    def __init__(self, text, ignore_whitespace):
+        # Lines removed before the text and by the comment which started at cut
+        self.first = 0
+        self.cut = len(text)
+        self.removed = 0
+        match = COMMENT.search(text)
+        if match is not None:
+            self.cut = match.start()
+            self.removed = text.count("\n", match.start(), match.end())
+            text = COMMENT.sub("", text)
+        if ignore_whitespace:
+            stripped = text.lstrip()
+            skipped = len(text) - len(stripped)
+            self.first = text.count("\n", 0, skipped)
+            self.cut -= skipped
+            text = stripped
+        self.text = text
+
+    def line(self, line, position):
+        """Returns the template line of a line of the text at position"""
+        line += self.first
+        if position >= self.cut:
+            line += self.removed
+        return line
+
+    def moved_like(self, old, position, delta):
+        """
+    Returns whether the lines of old from position on and those of this text
+    from position + delta moved by the same number of lines
+    """
+        if self.cut <= position + delta and old.cut <= position:
+            return True
+        return self.cut - delta == old.cut and self.removed == old.removed
+
+    def line_at(self, position):
+        """Returns the template line of a position in the text"""
+        return self.line(self.text.count("\n", 0, position) + 1, position)
+
+
+def write_all(io, value):
+    """Writes text or the list of parts held by a segment buffer"""
+    if value.__class__ is list:
+        for part in value:
+            io.write(part)
+    else:
+        io.write(value)
+
+
+class ViewContext(object):
+    """The state of a single render, this is the view object seen by templates"""
+
+    def __init__(self, view, io, model, body):
+        self.view = view
+        self.razor = view.razor
+        self.path = view.path
+        self.ignore_whitespace = view.ignore_whitespace
         self.io = io
-        self.renderer(io, model)
+        self.model = model
+        self.layout = None
+        self.layout_model = None
+        self._body = body
+        self._sections = dict()
 
     # Methods below here are expected to be called from within the template
     def tmpl(self, file, submodel=None):
         chModel = submodel or self.model
-        view = self.razor.render_file(file, chModel, self.ignore_whitespace)
-        self.io.write(view)
+        self.razor.render_file_to(self.io, file, chModel, self.ignore_whitespace)
 
-    def wrap(self, path, submodel=None):
-        if not os.path.isabs(path):
-            path = os.path.join(self.path, path)
+    def cached(self, key, ttl=None, tags=()):
+        """
+    Caches the output of the body of a for loop over it in the fragment cache
+    of the engine.  The body is rendered when key is not cached, otherwise
+    the cached output is written and the body is skipped:
+
+      @for _ in view.cached('menu', 60, ['pages']):
+        <nav>...</nav>
+    """
+        fragments = self.razor.Fragments
+        value = fragments.get(key)
+        if value is not None:
+            self._write_text(value)
+            return
+        mark = self._mark()
+        yield key
+        if mark is not None:
+            fragments.set(key, self._written_since(mark), ttl, tags)
 
-        self.__layoutModel = submodel or self.model
-        self.__layout = path
+    def fragment(self, file, key, submodel=None, ttl=None, tags=()):
+        """Renders a partial like tmpl through the fragment cache"""
+        for _ in self.cached(key, ttl, tags):
+            self.tmpl(file, submodel)
+
+    def _write_text(self, text):
+        io = self.io
+        if io.__class__ is EncodedIO:
+            text = text.encode(io.encoding)
+        io.write(text)
+
+    def _mark(self):
+        """Returns the position of the output or None when what is written next can not be read back"""
+        target = self.io.target if self.io.__class__ is EncodedIO else self.io
+        if target.__class__ is SegmentIO:
+            return len(target.parts)
+        if isinstance(target, bytearray):
+            return len(target)
+        if isinstance(target, (StringIO, BytesIO)):
+            return target.tell()
+        return None
+
+    def _written_since(self, mark):
+        """Returns the text written since _mark returned mark"""
+        io = self.io
+        target = io.target if io.__class__ is EncodedIO else io
+        if target.__class__ is SegmentIO:
+            value = target.empty.join(target.parts[mark:])
+        elif isinstance(target, bytearray):
+            value = bytes(target[mark:])
+        else:
+            target.seek(mark)
+            value = target.read()
+        if io.__class__ is EncodedIO:
+            value = value.decode(io.encoding)
+        return value
+
+    def wrap(self, path, submodel=None):
+        self.layout_model = submodel or self.model
+        self.layout = self.view.layout_path(path)
 
     def section(self, name):
         # TODO(alusco): Output a section
         raise NotImplementedError("Section isn't implemented yet")
 
     def body(self):
-        self.io.write(self._body)
+        body = self._body
+        if self.io.__class__ is EncodedIO and isinstance(body, text_type):
+            body = body.encode(self.io.encoding)
+        write_all(self.io, body)
 
-    @staticmethod
-    def parse(text, ignore_whitespace):
-        text = re.sub("@#.*#@", "", text, flags=re.S)
-        lexer = lex.RazorLexer.create(ignore_whitespace)
-        builder = ViewBuilder(lexer.scope)
-        for token in lexer.scan(text):
-            builder.parse(token)
-        return builder.build()
+
+class StreamIO(object):
+    """Collects the output of a streamed template until a chunk is full"""
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.size = 0
+        self.taken = 0
+        self.full = False
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.full = True
+
+    def take(self):
+        """Returns the collected output and starts a new chunk"""
+        value = u''.join(self.chunks)
+        self.chunks = []
+        self.taken += self.size
+        self.size = 0
+        self.full = False
+        return value
+
+    def tell(self):
+        """Returns the number of characters written"""
+        return self.taken + self.size
+
+
+class SegmentIO(object):
+    """
+  Collects the output of a template as the list of the strings written.
+  Static segments are kept by reference so nothing is copied until the parts
+  are joined or written out by something taking many buffers at once.
+  """
+
+    def __init__(self, empty=u''):
+        self.empty = empty
+        self.parts = []
+        self.write = self.parts.append
+
+    def tell(self):
+        return sum(map(len, self.parts))
+
+    def getvalue(self):
+        return self.empty.join(self.parts)
+
+    def close(self):
+        pass
+
+
+class EncodedIO(object):
+    """
+  Collects the encoded output of a template in a bytearray, a SegmentIO or a
+  binary file like object.  Only bytes are written, the templates rendered into it write
+  pre-encoded segments and encode their expressions.  Every piece is encoded
+  on its own so encodings starting with a byte order mark are refused, use
+  one with the byte order in its name such as utf-16-le.
+  """
+
+    def __init__(self, target, encoding='utf-8'):
+        if u''.encode(encoding):
+            raise ValueError("%s writes a byte order mark, use a variant without one" % encoding)
+        self.target = target
+        self.encoding = encoding
+        self.write = target.extend if isinstance(target, bytearray) else target.write
+
+    def tell(self):
+        if isinstance(self.target, bytearray):
+            return len(self.target)
+        return self.target.tell()
+
+    def getvalue(self):
+        return self.target.getvalue()
+
+    def close(self):
+        self.target.close()
 
 
 class ViewIO(StringIO):
@@ -76,6 +496,9 @@ class ViewIO(StringIO):
     def __init__(self):
         StringIO.__init__(self)
         self.scope = 0
+        # The template line of each line written, line is the current one
+        self.line = 0
+        self.lines = []
 
     def set_scope(self, scope):
         self.scope = scope
@@ -84,7 +507,7 @@ class ViewIO(StringIO):
         self.write("  " * self.scope)
 
     def write(self, text):
-        super(ViewIO, self).write(unicode(text))
+        super(ViewIO, self).write(text_type(text))
 
     def write_scope(self, text):
         """Writes the text prepending the scope"""
@@ -101,45 +524,233 @@ class ViewIO(StringIO):
         self.write(text)
         if text[-1] != '\n':
             self.write('\n')
+        self.lines.append(self.line)
 
 
 class ViewBuilder(object):
-    def __init__(self, scope):
+    STATIC = "STATIC"
+    DYNAMIC = "DYNAMIC"
+
+    # Imports the generated template function relies on when it is written
+    # out as a standalone module
+    MODULE_HEADER = "from escape import escape, text_type\n"
+    # Imports of the async variant, it is only generated for python 3.6+
+    ASYNC_HEADER = "from asyncview import isawaitable, iterate\n"
+    # The arguments following model of every template function
+    DEFAULTS = ", __s=__segments, __escape=escape, __text=text_type"
+
+    def __init__(self, scope, asynchronous=False):
+        # The template is generated twice, buffer holds the template function
+        # and stream holds a generator variant of it which yields the output
+        # collected by a StreamIO whenever it is full.  When asynchronous is
+        # set coroutine holds a third variant, a coroutine function awaiting
+        # the values of expressions and iterating over async iterables
         self.buffer = ViewIO()
+        self.stream = ViewIO()
+        self.coroutine = ViewIO() if asynchronous else None
+        self.outputs = [self.buffer, self.stream]
+        if asynchronous:
+            self.outputs.append(self.coroutine)
         self.cache = None
         self.lasttoken = (None,)
         self.scope = scope
-        self.buffer.set_scope(1)
+        # Set when the template may call view.wrap
+        self.wraps = False
+        # (kind, name) of the partials and layouts named by a literal
+        self.dependencies = []
+        # How the last expression was written, this decides how the new line
+        # following it is written
+        self.expression_output = None
+        # Scopes of functions defined by the template, their output never yields
+        self.functions = []
+        # Literal text waiting to be written by a single statement
+        self.pending = []
+        self.pending_scope = 0
+        self.pending_line = 0
+        # Static text of the template, written by index into __segments
+        self.segments = []
+        self.segment_index = dict()
+        # The generated code and segments, kept by close for restore
+        self.sources = None
+        # The template line of each line of the generated code, 0 for lines
+        # which do not come from the template
+        self.source_map = None
+        self.set_scope(1)
         self._write_header()
 
     def _write_header(self):
         """Writes the function header"""
         # The last line here must not have a trailing \n
-        self.buffer.write_line("def template(self, __io, model=None):")
-        self.buffer.scope_line("view = self")
+        # Static segments are hoisted into a module level tuple bound to a
+        # local through a default argument along with the output functions,
+        # View.encode_template swaps them for ones writing encoded bytes
+        self.buffer.write_line("def template(self, __io, model=None" + self.DEFAULTS + "):")
+        self.stream.write_line("def stream(self, __io, model=None" + self.DEFAULTS + "):")
+        if self.coroutine is not None:
+            self.coroutine.write_line("async def template_async(self, __io, model=None" + self.DEFAULTS +
+                                      ", __isawaitable=isawaitable, __iterate=iterate):")
+        self.scope_line("view = self")
+        self.scope_line("__write = __io.write")
+
+    def set_scope(self, scope):
+        for output in self.outputs:
+            output.set_scope(scope)
+
+    def set_line(self, line):
+        """Sets the template line the code written next comes from"""
+        for output in self.outputs:
+            output.line = line
+
+    def scope_line(self, text, coroutine_text=None):
+        """Writes a line to every template function, the async one may get its own version of it"""
+        self.buffer.scope_line(text)
+        self.stream.scope_line(text)
+        if self.coroutine is not None:
+            self.coroutine.scope_line(text if coroutine_text is None else coroutine_text)
+
+    def _leave_functions(self):
+        """Forgets the functions whose body ended before the current scope"""
+        while self.functions and self.functions[-1] >= self.buffer.scope:
+            self.functions.pop()
 
     def write_code(self, code):
         """Writes a line of code to the view buffer"""
-        self.buffer.scope_line(code.lstrip(' \t'))
+        code = code.lstrip(' \t')
+        self.flush_text()
+        self._leave_functions()
+        self.scope_line(code, self._coroutine_code(code))
+        if re.match(r"(?:def|class)\s", code):
+            self.functions.append(self.buffer.scope)
+        if MAY_WRAP.search(code):
+            self.wraps = True
+        self.find_dependencies(code)
+
+    def _coroutine_code(self, code):
+        """Returns a line of code as written in the async variant"""
+        if self.coroutine is None or self.functions:
+            return None
+        # Loops of the template body iterate over async iterables as well
+        match = FOR_LOOP.match(code)
+        if match is None:
+            return None
+        return "async for %s in __iterate(%s):" % match.groups()
+
+    def write_output(self, value):
+        """Writes a statement outputting the value of a python expression"""
+        self._leave_functions()
+        self.scope_line("__write(" + value + ")")
+        if not self.functions:
+            self.stream.scope_line("if __io.full: yield __io.take()")
+            if self.coroutine is not None:
+                self.coroutine.scope_line("if __io.full: await __io.flush()")
 
     def write_text(self, token):
         """Writes a token to the view buffer"""
         self.try_print_indent()
-        self.buffer.write_scope("__io.write(u'")
-        self.buffer.write(token)
-        self.buffer.write_line("')")
+        self.append_text(token)
+
+    def append_text(self, text):
+        """Queues literal text so adjacent text at the same scope is written at once"""
+        if self.pending and self.pending_scope != self.buffer.scope:
+            self.flush_text()
+        if not self.pending:
+            self.pending_scope = self.buffer.scope
+            self.pending_line = self.buffer.line
+        self.pending.append(text)
+
+    def flush_text(self):
+        """Writes the queued text at the scope it was queued in"""
+        text = u"".join(self.pending)
+        self.pending = []
+        if not text:
+            return
+        scope = self.buffer.scope
+        line = self.buffer.line
+        self.set_scope(self.pending_scope)
+        self.set_line(self.pending_line)
+        self.write_segment(text)
+        self.set_scope(scope)
+        self.set_line(line)
+
+    def write_segment(self, text):
+        """Writes a statement outputting static text"""
+        index = self.segment_index.get(text)
+        if index is None:
+            index = self.segment_index[text] = len(self.segments)
+            self.segments.append(text)
+        self.write_output("__s[%d]" % index)
 
-    def write_expression(self, expression):
+    def write_expression(self, expression, escaped=True):
         """Writes an expression to the current line"""
         self.try_print_indent()
-        self.buffer.write_scope("__e = ")
-        self.buffer.write_line(expression)
-        self.buffer.scope_line("if __e != None and __e != 'None':")
-        self.buffer.scope += 1
-        self.buffer.scope_line("__io.write(unicode(__e))")
+        constant, value = self._evaluate(expression)
+        if constant:
+            # Literals are output as static text, None prints nothing at all
+            self.expression_output = None if value is None else self.STATIC
+            if value is not None:
+                self.append_text(escape(value) if escaped else text_type(value))
+            return
+
+        self.flush_text()
+        self._leave_functions()
+        if MAY_WRAP.search(expression):
+            self.wraps = True
+        self.find_dependencies(expression)
+        self.scope_line("__e = " + expression)
+        if self.coroutine is not None and not self.functions:
+            self.coroutine.scope_line("if __isawaitable(__e): __e = await __e")
+        self.scope_line("if __e is not None:")
+        self.set_scope(self.buffer.scope + 1)
+        if escaped:
+            self.write_output("__escape(__e)")
+        else:
+            self.write_output("__e if __e.__class__ is __text else __text(__e)")
         # We rely on a hack in maybePrintNewline to determine
         # that the last token was an expression and to output the \n at scope+1
-        self.buffer.scope -= 1
+        self.set_scope(self.buffer.scope - 1)
+        self.expression_output = self.DYNAMIC
+
+    def find_dependencies(self, code):
+        """Records the partials and layouts a line of code names by a literal"""
+        for match in DEPENDENCY.finditer(code):
+            dependency = (match.group(1), match.group(3))
+            if dependency not in self.dependencies:
+                self.dependencies.append(dependency)
+
+    @staticmethod
+    def _evaluate(expression):
+        """Returns (True, value) if the expression is a text, number or None literal"""
+        try:
+            value = ast.literal_eval(expression.strip())
+            if value is None or isinstance(value, (text_type, str, int, float)):
+                return True, value if value is None else text_type(value)
+        except (ValueError, SyntaxError, TypeError, RuntimeError):
+            pass
+        return False, None
+
+    def checkpoint(self):
+        """Returns the state of the builder, the generated code is referred to by its length"""
+        return (tuple((output.tell(), len(output.lines)) for output in self.outputs), self.buffer.scope,
+                self.buffer.line, self.lasttoken, self.expression_output, tuple(self.functions),
+                tuple(self.pending), self.pending_scope, self.pending_line, len(self.segments), self.wraps,
+                tuple(self.dependencies))
+
+    def restore(self, state, sources):
+        """Restores a checkpoint taken by a builder whose sources are given"""
+        (lengths, scope, line, self.lasttoken, self.expression_output, functions, pending,
+         self.pending_scope, self.pending_line, segments, self.wraps, dependencies) = state
+        self.dependencies = list(dependencies)
+        for output, text, lines, length in zip(self.outputs, sources[0], sources[2], lengths):
+            output.seek(0)
+            output.truncate()
+            output.write(text[:length[0]])
+            output.lines = list(lines[:length[1]])
+        self.set_scope(scope)
+        self.set_line(line)
+        self.functions = list(functions)
+        self.pending = list(pending)
+        self.segments = list(sources[1][:segments])
+        self.segment_index = dict((segment, i) for i, segment in enumerate(self.segments))
 
     def get_template(self):
         """Retrieves the templates text"""
@@ -168,13 +779,17 @@ class ViewBuilder(object):
             self.write_text(token[1])
         elif token[0] == lex.Token.PARENEXPRESSION:
             self.write_expression(token[1])
+        elif token[0] == lex.Token.RAWPARENEXPRESSION:
+            self.write_expression(token[1], False)
         elif token[0] == lex.Token.ESCAPED:
             self.write_text(token[1])
         elif token[0] == lex.Token.EXPRESSION:
             self.write_expression(token[1])
+        elif token[0] == lex.Token.RAWEXPRESSION:
+            self.write_expression(token[1], False)
         elif token[0] == lex.Token.NEWLINE:
             self.try_print_newline()
-            self.buffer.set_scope(self.scope.get_scope() + 1)
+            self.set_scope(self.scope.get_scope() + 1)
 
         self.lasttoken = token
 
@@ -184,7 +799,7 @@ class ViewBuilder(object):
             return
 
         if len(self.lasttoken[1]) > 0:
-            self.buffer.scope_line("__io.write(u'" + self.lasttoken[1] + "')")
+            self.append_text(self.lasttoken[1])
 
     def try_print_newline(self):
         """Handles situationally printing a new line"""
@@ -193,34 +808,326 @@ class ViewBuilder(object):
 
         # Anywhere we writecode does not need the new line character
         no_new_line = {lex.Token.CODE, lex.Token.MULTILINE, lex.Token.ONELINE}
-        up_scope = {lex.Token.EXPRESSION, lex.Token.PARENEXPRESSION}
+        up_scope = {lex.Token.EXPRESSION, lex.Token.PARENEXPRESSION,
+                    lex.Token.RAWEXPRESSION, lex.Token.RAWPARENEXPRESSION}
         if not self.lasttoken[0] in no_new_line:
-            if self.lasttoken[0] in up_scope:
-                self.buffer.scope += 1
-            self.buffer.scope_line("__io.write(u'\\n')")
-            if self.lasttoken[0] in up_scope:
-                self.buffer.scope -= 1
+            if self.lasttoken[0] not in up_scope or self.expression_output == self.STATIC:
+                self.append_text(u"\n")
+            elif self.expression_output == self.DYNAMIC:
+                # Only written when the expression printed something
+                self.set_scope(self.buffer.scope + 1)
+                self.write_segment(u"\n")
+                self.set_scope(self.buffer.scope - 1)
 
     def close(self):
         if not self.cache:
-            self.cache = self.buffer.getvalue()
-            self.buffer.close()
+            self.flush_text()
+            # Hand out whatever is left, this also makes sure stream is a generator
+            self.stream.set_scope(1)
+            self.stream.scope_line("yield __io.take()")
+            self.sources = (tuple(output.getvalue() for output in self.outputs), tuple(self.segments),
+                            tuple(output.lines for output in self.outputs))
+            segments = "".join("    %r,\n" % segment for segment in self.segments)
+            parts = ["__segments = (\n", segments, ")\n\n\n"]
+            if self.coroutine is not None:
+                parts.insert(0, self.ASYNC_HEADER + "\n")
+            self.source_map = [0] * "".join(parts).count("\n")
+            for source, lines in zip(self.sources[0], self.sources[2]):
+                parts.extend([source, "\n\n"])
+                self.source_map.extend(lines)
+                self.source_map.extend([0, 0])
+            parts.append("template.stream = stream\n")
+            if self.coroutine is not None:
+                parts.append("template.async_template = template_async\n")
+            parts.extend([
+                "template.wraps = %r\n" % self.wraps,
+                "template.dependencies = %r\n" % (tuple(self.dependencies),)])
+            self.cache = "".join(parts)
+            self.source_map.extend([0] * (self.cache.count("\n") - len(self.source_map)))
+            for output in self.outputs:
+                output.close()
 
-    def build(self):
-        # Build our code and indent it one
+    def get_module(self, source, ignore_whitespace):
+        """Retrieves the template as the text of an importable python module"""
+        return "".join([
+            "# -*- coding: utf-8 -*-\n",
+            "# Generated by pyRazor %s from %s, do not edit.\n" % (__version__, source),
+            self.MODULE_HEADER,
+            "\nVERSION = %r\n" % __version__,
+            "IGNORE_WHITESPACE = %r\n\n\n" % bool(ignore_whitespace),
+            self.get_template()])
+
+    def compile(self, filename=None):
+        """
+    Compiles the template into a code object.  Regions which do not depend on
+    the model are folded into constants.  When the filename of the template
+    is given the code is numbered by the template lines it came from
+    so tracebacks and profiles point into the template.
+    """
         code = self.get_template()
-        # Compile this code
         logging.debug('Parsed code: %s', code)
-        block = compile(code, "view", "exec")
-        exec (block, globals(), locals())
-        # Builds a method which can render a template
-        return locals()['template']
+        foldable = has_candidates(code)
+        if filename is None and not foldable:
+            return compile(code, "view", "exec")
+
+        tree = ast.parse(code)
+        if foldable:
+            fold_constants(tree)
+        if filename is None:
+            return compile(tree, "view", "exec")
+        source_map = self.source_map
+        for node in ast.walk(tree):
+            if 'lineno' in node._attributes:
+                node.lineno = source_map[node.lineno - 1] or 1
+                # The end of a node may now come before its start
+                if getattr(node, 'end_lineno', None) is not None:
+                    node.end_lineno = None
+                    node.end_col_offset = None
+        return compile(tree, filename, "exec")
+
+    def build(self):
+        return ViewBuilder.load(self.compile())
+
+    @staticmethod
+    def load(block):
+        """Builds a method which can render a template from its code object"""
+        namespace = dict()
+        exec (block, globals(), namespace)
+        return namespace['template']
+
+
+def common_prefix(a, b):
+    """Returns the length of the common prefix of two strings"""
+    size = min(len(a), len(b))
+    length = 0
+    # Compare in halving blocks so the strings are compared in C
+    step = size
+    while step:
+        while length + step <= size and a[length:length + step] == b[length:length + step]:
+            length += step
+        step //= 2
+    return length
+
+
+def common_suffix(a, b, size):
+    """Returns the length of the common suffix of two strings, at most size"""
+    length = 0
+    step = size
+    while step:
+        while length + step <= size and \
+                a[len(a) - length - step:len(a) - length] == b[len(b) - length - step:len(b) - length]:
+            length += step
+        step //= 2
+    return length
+
+
+class Reparser(object):
+    """
+  Parses successive versions of a template, lexing an edited version only from
+  the last top level line before its first change.  The lexer and builder are
+  checkpointed after every new line at scope 0, and once lexing passes the end
+  of the change at a checkpoint the previous parse went through in the same
+  state the remaining tokens are replayed instead of lexed.
+  """
+
+    def __init__(self, ignore_whitespace, asynchronous=False):
+        self.ignore_whitespace = ignore_whitespace
+        self.asynchronous = asynchronous
+        self.text = None
+        self.tokens = []
+        # The scope depth of the lexer after each token, the builder reads it,
+        # and the template line of each token
+        self.scopes = []
+        self.lines = []
+        self.source = None
+        # (offset, token count, lexer state, builder state) of each checkpoint
+        self.checkpoints = []
+        self.sources = None
+        # Number of tokens lexed and reused by the last parse
+        self.lexed = 0
+        self.reused = 0
+        # Views reloaded by concurrent renders parse through the same reparser
+        self._lock = threading.Lock()
+
+    def generate(self, text):
+        """Parses the template text into a ViewBuilder holding the generated code"""
+        with self._lock:
+            return self._generate(text)
+
+    def _generate(self, text):
+        source = SourceLines(text, self.ignore_whitespace)
+        text = source.text
+        lexer = lex.RazorLexer.create(self.ignore_whitespace)
+        builder = ViewBuilder(lexer.scope, self.asynchronous)
+        tokens = []
+        scopes = []
+        lines = []
+        checkpoints = []
+        position = 0
+        resume = dict()
+        delta = 0
+        suffix = len(text) + 1
+
+        old = self.text
+        if old is not None:
+            prefix = common_prefix(old, text)
+            suffix = len(old) - common_suffix(old, text, min(len(old), len(text)) - prefix)
+            delta = len(text) - len(old)
+            # A self closing tag is matched up to the next @ so the tokens before
+            # a checkpoint only stand if an @ follows it before the change
+            limit = old.rfind('@', 0, prefix)
+            # The lines restored must not have moved
+            if source.first != self.source.first:
+                limit = -1
+            elif source.cut != self.source.cut or source.removed != self.source.removed:
+                limit = min(limit, source.cut, self.source.cut)
+            start = None
+            for i, checkpoint in enumerate(self.checkpoints):
+                if checkpoint[0] > limit:
+                    break
+                start = i
+            if start is not None:
+                position, count, lexer_state, builder_state = self.checkpoints[start]
+                lexer.restore(lexer_state)
+                builder.restore(builder_state, self.sources)
+                tokens = self.tokens[:count]
+                scopes = self.scopes[:count]
+                lines = self.lines[:count]
+                checkpoints = self.checkpoints[:start + 1]
+            resume = dict((checkpoint[0], i) for i, checkpoint in enumerate(self.checkpoints))
+
+        scanner = lexer.lexer.scan(text, position)
+        lexed = 0
+        replay = None
+        for token in scanner:
+            lexed += 1
+            line = source.line(scanner.token_position()[0], scanner.start)
+            tokens.append(token)
+            scopes.append(lexer.scope.scope)
+            lines.append(line)
+            builder.set_line(line)
+            builder.parse(token)
+            if token[0] != lex.Token.NEWLINE:
+                continue
+            state = lexer.checkpoint(scanner)
+            if state is None:
+                continue
+            offset = scanner._position
+            checkpoints.append((offset, len(tokens), state, builder.checkpoint()))
+            i = resume.get(offset - delta)
+            if offset - delta >= suffix and i is not None and self.checkpoints[i][2] == state and \
+                    source.moved_like(self.source, offset - delta, delta):
+                replay = i
+                break
+
+        self.reused = 0
+        if replay is not None:
+            following = replay + 1
+            count, offset = self.checkpoints[replay][1], self.checkpoints[replay][0]
+            # The lines following the edit moved by as many lines as it added
+            moved = source.line_at(offset + delta) - self.source.line_at(offset)
+            for token, scope, line in zip(self.tokens[count:], self.scopes[count:], self.lines[count:]):
+                count += 1
+                tokens.append(token)
+                scopes.append(scope)
+                lines.append(line + moved)
+                lexer.scope.scope = scope
+                builder.set_line(line + moved)
+                builder.parse(token)
+                if following < len(self.checkpoints) and self.checkpoints[following][1] == count:
+                    checkpoint = self.checkpoints[following]
+                    checkpoints.append((checkpoint[0] + delta, len(tokens), checkpoint[2], builder.checkpoint()))
+                    following += 1
+            self.reused = count - self.checkpoints[replay][1]
+
+        builder.close()
+        self.text = text
+        self.source = source
+        self.tokens = tokens
+        self.scopes = scopes
+        self.lines = lines
+        self.checkpoints = checkpoints
+        self.sources = builder.sources
+        self.lexed = lexed
+        return builder
+
+
+def find_templates(root, extensions=EXTENSIONS):
+    """Yields the paths of all templates below root relative to root"""
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1] in extensions:
+                yield os.path.relpath(os.path.join(directory, name), root)
+
+
+def compile_marshalled(args):
+    """Compiles (text, ignore_whitespace, asynchronous) into a marshalled code object, run by worker processes"""
+    text, ignore_whitespace, asynchronous = args
+    return marshal.dumps(View.compile(text, ignore_whitespace, asynchronous))
+
+
+# Engines of the worker processes rendering for render_many by their settings
+_engines = dict()
+
+
+def render_chunk(args):
+    """Renders a view once per model of a chunk, run by worker processes"""
+    settings, address, ignore_whitespace, models = args
+    razor = _engines.get(settings)
+    if razor is None:
+        view_root, compiled_root, cache_dir = settings
+        razor = _engines[settings] = PyRazor(cache_dir)
+        razor.ViewRoot = list(view_root)
+        razor.CompiledRoot = list(compiled_root)
+    results = []
+    razor.render_many(address, models, ignore_whitespace, results.append)
+    return results
+
+
+def import_file(path):
+    """Imports a python source file as an anonymous module"""
+    name = '_razor_' + hashlib.md5(os.path.abspath(path).encode('utf-8')).hexdigest()
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:
+        import imp
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 
 class PyRazor:
-    def __init__(self):
+    def __init__(self, cache_dir=None):
         self.__mem = dict()
         self.ViewRoot = [""]
+        # Directories holding modules written by viewcompiler, these are
+        # searched before ViewRoot so compiled views are never lexed
+        self.CompiledRoot = []
+        # When set views are recompiled after their file changed, the file is
+        # checked at most once every ReloadInterval seconds
+        self.AutoReload = False
+        self.ReloadInterval = 1.0
+        self.__stamps = dict()
+        # Reparsers keeping the last parse of each view while AutoReload is set
+        # so an edited file is only lexed from its first changed line
+        self.__reparsers = dict()
+        # Names of the views depending on a view, by the name of that view
+        self.__dependents = dict()
+        # When set views are also compiled into a coroutine function rendered
+        # by the *_async methods, this requires python 3.6+
+        self.Asynchronous = False
+        # Views compiled from template strings passed to render
+        self.TextCache = LRUCache(max_entries=1024)
+        # Output cached by view.cached and view.fragment
+        self.Fragments = FragmentCache()
+        # The Profiler set by enable_profiling
+        self.Profiler = None
+        self.Cache = None
+        if cache_dir is not None:
+            self.Cache = BytecodeCache(cache_dir)
 
     def __load(self, name):
         for path in self.ViewRoot:
@@ -228,6 +1135,7 @@ class PyRazor:
             if os.path.exists(p):
                 f = open(p)
                 view = f.read()
+                self.__stamp(name, p, os.fstat(f.fileno()))
                 f.close()
                 return view
         error = ""
@@ -235,24 +1143,358 @@ class PyRazor:
             error += os.path.join(path, name) + " -->  Not Found!\n"
         raise EnvironmentError(error)
 
+    def __load_compiled(self, name):
+        """Loads a view from a precompiled module, returns None if there is none"""
+        module_name = os.path.splitext(name)[0] + '.py'
+        for path in self.CompiledRoot:
+            p = os.path.join(path, module_name)
+            if os.path.exists(p):
+                self.__stamp(name, p, os.stat(p))
+                module = import_file(p)
+                return View(self, module.template, module.IGNORE_WHITESPACE, name)
+        return None
+
+    def __build(self, text, ignore_whitespace, path):
+        """Builds a view, going through the bytecode cache when enabled"""
+        # Profiled views are always compiled so each one is timed and
+        # numbered by the lines of its own file
+        if self.Cache is None or self.Profiler is not None:
+            return View(self, ViewBuilder.load(self.__compile(text, ignore_whitespace, path)), ignore_whitespace, path)
+
+        key = self.__key(text, ignore_whitespace)
+        code = self.Cache.load(key)
+        if code is None:
+            code = self.__compile(text, ignore_whitespace, path)
+            self.Cache.store(key, code)
+        return View(self, ViewBuilder.load(code), ignore_whitespace, path)
+
+    def __compile(self, text, ignore_whitespace, path):
+        """Compiles the text of a view, reparsing the previous version of a file on reload"""
+        if self.Profiler is not None:
+            return self.__compile_profiled(text, ignore_whitespace, path)
+        if not self.AutoReload or not path:
+            return View.compile(text, ignore_whitespace, self.Asynchronous)
+        return self.__reparse(text, ignore_whitespace, path).compile()
+
+    def __reparse(self, text, ignore_whitespace, path):
+        reparser = self.__reparsers.get(path)
+        if reparser is None or reparser.ignore_whitespace != ignore_whitespace or \
+                reparser.asynchronous != self.Asynchronous:
+            reparser = self.__reparsers[path] = Reparser(ignore_whitespace, self.Asynchronous)
+        return reparser.generate(text)
+
+    def __compile_profiled(self, text, ignore_whitespace, path):
+        """Compiles a view numbered by the lines of its file, timing the parse and the compile"""
+        start = timer()
+        if not self.AutoReload or not path:
+            builder = View.generate(text, ignore_whitespace, self.Asynchronous)
+        else:
+            builder = self.__reparse(text, ignore_whitespace, path)
+        parsed = timer()
+        filename = self.__stamps[path][0] if path in self.__stamps else '<string>'
+        code = builder.compile(filename)
+        self.Profiler.on_parse(path or '<string>', filename, parsed - start, timer() - parsed)
+        return code
+
+    def __key(self, text, ignore_whitespace):
+        """Returns the bytecode cache key of a view"""
+        version = __version__
+        if self.Asynchronous:
+            version += '-async'
+        return self.Cache.key(text, ignore_whitespace, version)
+
+    def __add(self, name, view):
+        """Holds on to a loaded view and records what it depends on"""
+        self.__mem[name] = view
+        for dependency in view.dependencies:
+            self.__dependents.setdefault(dependency, set()).add(name)
+
+    def __preload(self, names, ignore_whitespace, pool, errors):
+        """
+    Loads the named views, compiling them in the pool when there is one.  A
+    view which fails to load is left out and its error kept in errors.
+    """
+        texts = []
+        for name in names:
+            if name in self.__mem:
+                continue
+            try:
+                view = self.__load_compiled(name)
+                if view is None and (pool is None or self.Profiler is not None):
+                    view = self.__build(self.__load(name), ignore_whitespace, name)
+                if view is not None:
+                    self.__add(name, view)
+                    continue
+                text = self.__load(name)
+            except Exception as e:
+                errors[name] = e
+                continue
+            code = None
+            if self.Cache is not None:
+                code = self.Cache.load(self.__key(text, ignore_whitespace))
+            texts.append((name, text, code))
+
+        pending = [(text, ignore_whitespace, self.Asynchronous) for name, text, code in texts if code is None]
+        try:
+            compiled = iter(pool.map(compile_marshalled, pending) if pending else ())
+        except Exception:
+            # A view which does not compile fails the whole map, the failing
+            # one is found by compiling them here
+            compiled = None
+        for name, text, code in texts:
+            if code is None:
+                try:
+                    if compiled is not None:
+                        code = marshal.loads(next(compiled))
+                    else:
+                        code = View.compile(text, ignore_whitespace, self.Asynchronous)
+                except Exception as e:
+                    errors[name] = e
+                    continue
+                if self.Cache is not None:
+                    self.Cache.store(self.__key(text, ignore_whitespace), code)
+            self.__add(name, View(self, ViewBuilder.load(code), ignore_whitespace, name))
+
+    def __stamp(self, name, path, stat):
+        """Records the state of the file a view was loaded from"""
+        self.__stamps[name] = [path, (stat.st_mtime, stat.st_size, stat.st_ino), time.time()]
+
+    def __is_stale(self, name):
+        """Checks whether the file of a view changed since it was loaded"""
+        entry = self.__stamps.get(name)
+        if entry is None:
+            return False
+        now = time.time()
+        if now - entry[2] < self.ReloadInterval:
+            return False
+        entry[2] = now
+        try:
+            stat = os.stat(entry[0])
+        except OSError:
+            return True
+        return entry[1] != (stat.st_mtime, stat.st_size, stat.st_ino)
+
     def __get_view(self, name, ignore_whitespace):
+        if self.AutoReload and name in self.__mem and self.__is_stale(name):
+            logging.debug('Reloading view %s', name)
+            self.invalidate(name)
         if name not in self.__mem:
-            self.__mem[name] = View(self, self.__load(name), ignore_whitespace, name)
+            view = self.__load_compiled(name)
+            if view is None:
+                view = self.__build(self.__load(name), ignore_whitespace, name)
+            self.__add(name, view)
         return self.__mem[name]
 
+    def invalidate(self, name):
+        """Drops a view and every view depending on it, they are reloaded when next rendered"""
+        names = [name]
+        while names:
+            name = names.pop()
+            self.__mem.pop(name, None)
+            names.extend(self.__dependents.pop(name, ()))
+
+    def warmup(self, root=None, ignore_whitespace=False, processes=None, extensions=EXTENSIONS, errors=None):
+        """
+    Loads every view below root, or below each ViewRoot, along with the
+    partials and layouts they name so no render pays for compiling them.
+    root must be inside one of the ViewRoot directories.  Views are compiled
+    by a pool of processes when processes is given.  A view which fails to
+    load does not stop the others, its error is logged and kept by name in
+    the errors dict when one is given.  Returns the dependency graph of the
+    loaded views.
+    """
+        if errors is None:
+            errors = dict()
+        names = []
+        for directory, prefix in self.__template_roots(root):
+            for name in find_templates(directory, extensions):
+                names.append(os.path.join(prefix, name) if prefix else name)
+
+        pool = None
+        if processes is not None:
+            pool = multiprocessing.Pool(processes)
+        try:
+            seen = set()
+            while names:
+                names = [name for name in names if name not in seen]
+                seen.update(names)
+                self.__preload(names, ignore_whitespace, pool, errors)
+                names = [dependency for name in names if name in self.__mem
+                         for dependency in self.__mem[name].dependencies]
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        for name in sorted(errors):
+            logging.warning('Could not load view %s: %s', name, errors[name])
+        return self.dependency_graph()
+
+    def __template_roots(self, root):
+        """
+    Returns the directories warmup searches along with the prefix which makes
+    the names found below each relative to its ViewRoot entry.
+    """
+        if root is None:
+            return [(directory or os.curdir, '') for directory in self.ViewRoot]
+        path = os.path.abspath(root)
+        for directory in self.ViewRoot:
+            base = os.path.abspath(directory or os.curdir)
+            if path == base or path.startswith(base.rstrip(os.sep) + os.sep):
+                prefix = os.path.relpath(path, base)
+                return [(path, '' if prefix == os.curdir else prefix)]
+        raise ValueError("%s is not inside any of the view roots %s" % (root, self.ViewRoot))
+
+    def enable_profiling(self, profiler=None):
+        """
+    Records the parse, compile and render times of every view in profiler, a
+    new Profiler by default, and returns it.  Loaded views are dropped so
+    they are compiled again numbered by the lines of their template.
+    """
+        self.disable_profiling()
+        self.Profiler = profiler if profiler is not None else Profiler()
+        for name, kind, name_arg, io_arg in PROFILED:
+            method = self.Profiler.instrument(getattr(self, name), kind, name_arg, io_arg, name.startswith('stream'))
+            setattr(self, name, method)
+        return self.Profiler
+
+    def disable_profiling(self):
+        """Stops profiling, the render methods are no longer wrapped"""
+        for name, kind, name_arg, io_arg in PROFILED:
+            self.__dict__.pop(name, None)
+        self.Profiler = None
+        self.__mem.clear()
+        self.TextCache.clear()
+
+    def dependency_graph(self):
+        """Returns the names of the views each loaded view depends on"""
+        return dict((name, view.dependencies) for name, view in self.__mem.items())
+
+    def compile(self, text, ignore_whitespace=False):
+        """Compiles template text into a view which can be rendered repeatedly"""
+        # The text itself is the key: str caches its hash and the dict lookup
+        # compares by identity first, so a hit on the same string is O(1) and
+        # only a colliding hash falls back to comparing the text
+        key = (text, ignore_whitespace)
+        view = self.TextCache.get(key)
+        if view is None:
+            view = self.__build(text, ignore_whitespace, '')
+            self.TextCache.set(key, view, len(text) + view.get_size())
+        return view
+
     def render(self, text, model=None, ignore_whitespace=False):
-        key = hashlib.md5(text.encode('utf-8')).hexdigest()
-        if str(key) not in self.__mem:
-            self.__mem[key] = View(self, text, ignore_whitespace, '')
-        return self.__mem[key].render(model)
+        return self.compile(text, ignore_whitespace).render(model)
 
     def render_file(self, address, model=None, ignore_whitespace=False):
         view = self.__get_view(address, ignore_whitespace)
         return view.render(model)
 
+    def render_file_to(self, io, address, model=None, ignore_whitespace=False):
+        view = self.__get_view(address, ignore_whitespace)
+        view.render_to(io, model)
+
     def render_layout(self, address, body, model=None, ignore_whitespace=False):
         view = self.__get_view(address, ignore_whitespace)
-        view._body = body
-        return view.render(model)
+        return view.render(model, body)
+
+    def render_layout_to(self, io, address, body, model=None, ignore_whitespace=False):
+        view = self.__get_view(address, ignore_whitespace)
+        view.render_to(io, model, body)
+
+    # The methods below render encoded bytes, the static text of each view is
+    # encoded once and only the expressions are encoded while rendering
+    def render_segments(self, text, model=None, ignore_whitespace=False, encoding=None):
+        return self.compile(text, ignore_whitespace).render_segments(model, encoding)
+
+    def render_file_segments(self, address, model=None, ignore_whitespace=False, encoding=None):
+        """Renders a view file into a list of strings, or of bytes when an encoding is given"""
+        view = self.__get_view(address, ignore_whitespace)
+        return view.render_segments(model, encoding)
+
+    def render_bytes(self, text, model=None, ignore_whitespace=False, encoding='utf-8'):
+        return self.compile(text, ignore_whitespace).render_bytes(model, encoding)
+
+    def render_file_bytes(self, address, model=None, ignore_whitespace=False, encoding='utf-8'):
+        view = self.__get_view(address, ignore_whitespace)
+        return view.render_bytes(model, encoding)
+
+    def render_file_bytes_to(self, target, address, model=None, ignore_whitespace=False, encoding='utf-8'):
+        """Renders a view file into a bytearray or a binary file like object"""
+        view = self.__get_view(address, ignore_whitespace)
+        view.render_bytes_to(target, model, encoding)
+
+    def render_many(self, address, models, ignore_whitespace=False, sink=None, processes=None, chunk_size=256):
+        """
+    Renders a view file once per model.  The view is looked up and compiled
+    once and its buffers are reused.  Each output is passed to sink in order
+    when it is given, otherwise the list of outputs is returned.  With
+    processes set the models are rendered in chunks of chunk_size by a pool
+    of processes, they must be picklable.
+    """
+        results = None
+        if sink is None:
+            results = []
+            sink = results.append
+        if processes is None:
+            self.__get_view(address, ignore_whitespace).render_many(models, sink)
+            return results
+
+        cache_dir = self.Cache.directory if self.Cache is not None else None
+        settings = (tuple(self.ViewRoot), tuple(self.CompiledRoot), cache_dir)
+        chunks = self.__chunks(models, chunk_size)
+        pool = multiprocessing.Pool(processes)
+        try:
+            for chunk in pool.imap(render_chunk, ((settings, address, ignore_whitespace, chunk)
+                                                  for chunk in chunks)):
+                for output in chunk:
+                    sink(output)
+        finally:
+            pool.close()
+            pool.join()
+        return results
+
+    @staticmethod
+    def __chunks(models, chunk_size):
+        chunk = []
+        for model in models:
+            chunk.append(model)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def get_view(self, address, ignore_whitespace=False):
+        """Returns the view of a file, loading it when needed"""
+        return self.__get_view(address, ignore_whitespace)
+
+    def stream(self, text, model=None, ignore_whitespace=False, chunk_size=8192):
+        return self.compile(text, ignore_whitespace).stream(model, chunk_size)
+
+    def stream_file(self, address, model=None, ignore_whitespace=False, chunk_size=8192):
+        view = self.__get_view(address, ignore_whitespace)
+        return view.stream(model, chunk_size)
+
+    def stream_layout(self, address, body, model=None, ignore_whitespace=False, chunk_size=8192):
+        view = self.__get_view(address, ignore_whitespace)
+        return view.stream(model, chunk_size, body)
+
+    # The methods below return coroutines, the views are rendered by asyncview
+    # which needs python 3.6+.  Views compiled without Asynchronous are
+    # rendered synchronously.
+    def render_async(self, text, model=None, ignore_whitespace=False):
+        import asyncview
+        return asyncview.render(self.compile(text, ignore_whitespace), model)
+
+    def render_file_async(self, address, model=None, ignore_whitespace=False):
+        import asyncview
+        return asyncview.render(self.__get_view(address, ignore_whitespace), model)
+
+    def stream_async(self, writer, text, model=None, ignore_whitespace=False, chunk_size=8192):
+        import asyncview
+        return asyncview.stream(self.compile(text, ignore_whitespace), writer, model, chunk_size)
+
+    def stream_file_async(self, writer, address, model=None, ignore_whitespace=False, chunk_size=8192):
+        import asyncview
+        return asyncview.stream(self.__get_view(address, ignore_whitespace), writer, model, chunk_size)
 
 pyrazor = PyRazor()
@@ -97,3 +97,17 @@ class ScopeStack(object):
     def handle_indentation(self, indent):
         """Handles indention level"""
         self.indentstack.handle_indentation(indent)
+
+    def checkpoint(self):
+        """
+    Returns the indentation when no scope is open, None otherwise.  A scope
+    stack in this state is restored by setting the indentation alone.
+    """
+        stack = self.indentstack
+        if self.scope or stack.stack or stack.handlers or stack.mark:
+            return None
+        return stack.indentation
+
+    def restore(self, indentation):
+        """Restores the state returned by checkpoint"""
+        self.indentstack.indentation = indentation
@@ -9,12 +9,15 @@ class TokenError(Exception):
      when parsing.
   """
 
-    def __init__(self, token, lineno):
+    def __init__(self, token, lineno, column=None):
         self.token = token
         self.lineno = lineno
+        self.column = column
 
     def __str__(self):
-        return "Line #%s, Found token: %s" % (self.lineno, self.token)
+        if self.column is None:
+            return "Line #%s, Found token: %s" % (self.lineno, self.token)
+        return "Line #%s, Column #%s, Found token: %s" % (self.lineno, self.column, self.token)
 
 
 class InvalidTokenError(TokenError):
@@ -24,11 +27,11 @@ class InvalidTokenError(TokenError):
      with lineno and the matched portion of the token.
   """
 
-    def __init__(self, token=None, lineno=None):
+    def __init__(self, token=None, lineno=None, column=None):
         """A constructor that can be used by callbacks to signify an
        error.  This will be caught and reraised with position and
        line number information"""
-        TokenError.__init__(self, token, lineno)
+        TokenError.__init__(self, token, lineno, column)
 
 
 class UnknownTokenError(TokenError):
@@ -50,14 +53,20 @@ class _InputScanner(object):
       mainly to be used by the Lexer and ideally not directly.
   """
 
-    def __init__(self, lexer, input):
+    def __init__(self, lexer, input, position=0):
         """ Put the lexer into this instance so the callbacks can reference it
         if needed.
     """
-        self._position = 0
+        self._position = position
         self.lexer = lexer
         self.input = input
         self.Mode = ScannerMode.Text
+        # Offset of the token last returned by scan_next
+        self.start = position
+        # Line bookkeeping, the line and line start of _line_position
+        self._line = 1
+        self._line_start = 0
+        self._line_position = 0
 
     def __iter__(self):
         """ All of the code for iteration is controlled by the class itself.
@@ -86,6 +95,29 @@ class _InputScanner(object):
     """
         return self._position >= len(self.input)
 
+    def line_column(self, position=None):
+        """ Returns the line and column of position, by default the current
+        position.  Lines are counted from the last position asked for so
+        walking forward through the input counts every line once.
+    """
+        if position is None:
+            position = self._position
+        if position < self._line_position:
+            self._line = 1
+            self._line_start = 0
+            self._line_position = 0
+        newlines = self.input.count("\n", self._line_position, position)
+        if newlines:
+            self._line += newlines
+            self._line_start = self.input.rfind("\n", self._line_position, position) + 1
+        self._line_position = position
+        return self._line, position - self._line_start + 1
+
+    def token_position(self):
+        """ Returns the line and column of the token last scanned
+    """
+        return self.line_column(self.start)
+
     def scan_next(self):
         """ Retreive the next token from the input. If the
         flag `omit_whitespace` is set to True, then it will
@@ -94,67 +126,125 @@ class _InputScanner(object):
         if self.done_scanning():
             return None
 
-        # Try to match a token
+        # Try the rules of the current mode in order, the first one to match wins
         if self.Mode == ScannerMode.CODE:
-            match = self.lexer.regex_line.match(self.input, self._position)
+            steps = self.lexer.line_steps
         else:
-            match = self.lexer.regexc.match(self.input, self._position)
-
-        if match is None:
-            lineno = self.input[:self._position].count("\n") + 1
-            raise UnknownTokenError(self.input[self._position], lineno)
+            steps = self.lexer.steps
+        for step in steps:
+            match = step.match(self.input, self._position)
+            if match is not None:
+                break
+        else:
+            lineno, column = self.line_column()
+            raise UnknownTokenError(self.input[self._position], lineno, column)
 
-        self._position = match.end()
-        value = match.group(match.lastgroup)
+        end, name, callback = match
+        self.start = self._position
+        value = self.input[self._position:end]
+        self._position = end
 
         # Callback
-        if match.lastgroup in self.lexer._callbacks:
+        if callback is not None:
             try:
-                value = self.lexer._callbacks[match.lastgroup](self, value)
+                value = callback(self, value)
             except InvalidTokenError:
                 # raise with some actual information
-                lineno = self.input[:self._position].count("\n") + 1
-                raise InvalidTokenError(self.input[self._position], lineno)
-        return match.lastgroup, value
+                lineno, column = self.token_position()
+                raise InvalidTokenError(value, lineno, column)
+        return name, value
+
+
+class _RegexStep(object):
+    """ A run of regular expression rules compiled into a single alternation.
+      The rule that matched is found by the index of its group instead of its
+      name.
+  """
+
+    def __init__(self, rules, flags):
+        parts = []
+        self.table = [None]
+        for name, rule, callback in rules:
+            parts.append("(%s)" % rule)
+            self.table.append((name, callback))
+            # Groups inside the rule are never the last index of a match, they
+            # close before the group around the rule
+            self.table.extend([None] * re.compile(rule, flags).groups)
+        self.regex = re.compile("|".join(parts), flags)
+
+    def match(self, input, position):
+        match = self.regex.match(input, position)
+        if match is None:
+            return None
+        name, callback = self.table[match.lastindex]
+        return match.end(), name, callback
+
+
+class _MatcherStep(object):
+    """ A rule given as an object with a match(input, position) method which
+      returns the end of the token or -1.
+  """
+
+    def __init__(self, name, matcher, callback):
+        self.name = name
+        self.matcher = matcher
+        self.callback = callback
+
+    def match(self, input, position):
+        end = self.matcher.match(input, position)
+        if end < 0:
+            return None
+        return end, self.name, self.callback
 
 
 class Lexer(object):
     """ A lexical scanner. It takes in an input and a set of rules based
       on reqular expressions. It then scans the input and returns the
       tokens one-by-one. It is meant to be used through iterating.
+
+      A rule may also be an object with a match(input, position) method, this
+      is used for rules which a regular expression can only match by rescanning
+      the input.
   """
 
     def __init__(self, rules, mrules, case_sensitive=False):
         """ Set up the lexical scanner. Build and compile the regular expression
         and prepare the whitespace searcher.
     """
-        self._callbacks = {}
         self.case_sensitive = case_sensitive
-        parts = []
-        mparts = []
-
-        for name, rule in rules:
-            if not isinstance(rule, str):
-                rule, callback = rule
-                self._callbacks[name] = callback
-            parts.append("(?P<%s>%s)" % (name, rule))
-
-        for name, mrule in mrules:
-            if not isinstance(mrule, str):
-                mrule, callback = mrule
-                self._callbacks[name] = callback
-            mparts.append("(?P<%s>%s)" % (name, mrule))
 
         if self.case_sensitive:
             flags = re.M
         else:
             flags = re.M | re.I
 
-        self.regex_line = re.compile("|".join(mparts), flags)
-        self.regexc = re.compile("|".join(parts), flags)
+        self.line_steps = self._compile(mrules, flags)
+        self.steps = self._compile(rules, flags)
 
-    def scan(self, input):
-        """ Return a scanner built for matching through the `input` field.
-        The scanner that it returns is built well for iterating.
+    @staticmethod
+    def _compile(rules, flags):
+        """ Compiles consecutive regular expression rules into single steps
+    """
+        steps = []
+        run = []
+        for name, rule in rules:
+            callback = None
+            if isinstance(rule, tuple):
+                rule, callback = rule
+            if isinstance(rule, str):
+                run.append((name, rule, callback))
+                continue
+            if run:
+                steps.append(_RegexStep(run, flags))
+                run = []
+            steps.append(_MatcherStep(name, rule, callback))
+        if run:
+            steps.append(_RegexStep(run, flags))
+        return steps
+
+    def scan(self, input, position=0):
+        """ Return a scanner built for matching through the `input` field
+        from position.  The scanner that it returns is built well for
+        iterating.
     """
-        return _InputScanner(self, input)
+        return _InputScanner(self, input, position)
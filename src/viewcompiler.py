@@ -0,0 +1,219 @@
+# Compiles trees of razor templates into importable python modules
+#
+# Usage: python viewcompiler.py [-w] [-f] [-v] [-j jobs] [-e .pyhtml]
+#                               [--cache cache_dir] view_root [output_dir]
+#
+# Each template is written to output_dir under its path relative to the view
+# root with its extension replaced by .py.  Add output_dir to
+# PyRazor.CompiledRoot to render the compiled modules instead of parsing the
+# templates at runtime.  With --cache the code objects are written to a
+# bytecode cache directory instead, pass it to PyRazor(cache_dir) to skip
+# compiling at runtime.  With -j the templates are compiled by that many
+# processes, 0 uses every CPU.
+
+import argparse
+import io
+import logging
+import marshal
+import multiprocessing
+import os
+import os.path
+import re
+import sys
+import time
+import traceback
+
+from cache import BytecodeCache
+from razorview import EXTENSIONS, View, __version__, find_templates
+
+# The engine version recorded in a compiled module
+MODULE_VERSION = re.compile(r"^VERSION = '([^']*)'$", re.M)
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:
+    ProcessPoolExecutor = None
+
+
+class CompileResult(object):
+    """
+  The outcome of compiling one template.  Depending on what was asked for
+  source holds the text of its module and code its marshalled code object,
+  error describes why it failed.
+  """
+
+    def __init__(self, name, seconds, error=None, source=None, code=None):
+        self.name = name
+        self.seconds = seconds
+        self.error = error
+        self.source = source
+        self.code = code
+
+
+class CompileError(Exception):
+    """Raised with the results of the templates which failed to compile"""
+
+    def __init__(self, failed):
+        Exception.__init__(self, "\n".join("%s: %s" % (result.name, result.error) for result in failed))
+        self.failed = failed
+
+
+def module_path(name):
+    """Returns the path of the module a template is compiled into"""
+    return os.path.splitext(name)[0] + '.py'
+
+
+def compile_template(source, target, ignore_whitespace=False):
+    """Compiles a single template file into a python module"""
+    with open(source) as f:
+        text = f.read()
+    builder = View.generate(text, ignore_whitespace)
+    # Make sure the module is valid before anything is written
+    builder.compile()
+    write_module(target, builder.get_module(os.path.basename(source), ignore_whitespace))
+
+
+def write_module(target, module):
+    directory = os.path.dirname(target)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with io.open(target, 'w', encoding='utf-8') as f:
+        f.write(module)
+
+
+def compile_job(job):
+    """Compiles one template for compile_many, this runs in the worker processes"""
+    root, name, ignore_whitespace, output, cache_dir, result = job
+    source = os.path.join(root, name)
+    start = time.time()
+    try:
+        with open(source) as f:
+            text = f.read()
+        builder = View.generate(text, ignore_whitespace)
+        code = builder.compile()
+        module = None
+        if output is not None or result == 'source':
+            module = builder.get_module(os.path.basename(source), ignore_whitespace)
+        if output is not None:
+            logging.debug('Compiling %s -> %s', source, output)
+            write_module(os.path.join(output, module_path(name)), module)
+        if cache_dir is not None:
+            cache = BytecodeCache(cache_dir)
+            cache.store(cache.key(text, ignore_whitespace, __version__), code)
+    except Exception as e:
+        error = traceback.format_exception_only(type(e), e)[-1].strip()
+        return CompileResult(name, time.time() - start, error=error)
+    return CompileResult(name, time.time() - start,
+                         source=module if result == 'source' else None,
+                         code=marshal.dumps(code) if result == 'code' else None)
+
+
+def compile_many(root, names=None, ignore_whitespace=False, jobs=None, output=None, cache_dir=None,
+                 result='code', extensions=EXTENSIONS):
+    """Compiles the named templates below root, by default all of them.
+
+  The templates are compiled by a pool of jobs processes, 0 starts one per
+  CPU and None compiles them in this process.  Modules are written to output
+  and code objects to the bytecode cache in cache_dir when they are given.
+  result selects what is sent back, 'code' for the marshalled code object,
+  'source' for the module text or None.  Returns a CompileResult per template
+  in the order of names, a template failing does not stop the others.
+  """
+    if names is None:
+        names = list(find_templates(root, extensions))
+    tasks = [(root, name, ignore_whitespace, output, cache_dir, result) for name in names]
+    if jobs is None or jobs == 1 or len(tasks) < 2:
+        return [compile_job(task) for task in tasks]
+
+    workers = jobs or multiprocessing.cpu_count()
+    # Batches keep the workers busy without a round trip per template
+    chunksize = max(1, len(tasks) // (workers * 4))
+    if ProcessPoolExecutor is None:
+        pool = multiprocessing.Pool(workers)
+        try:
+            return pool.map(compile_job, tasks, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    with ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(compile_job, tasks, chunksize=chunksize))
+
+
+def module_version(target):
+    """Returns the engine version a module was compiled by, None if it has none"""
+    try:
+        with io.open(target, encoding='utf-8') as f:
+            match = MODULE_VERSION.search(f.read())
+    except (IOError, OSError, ValueError):
+        return None
+    return match.group(1) if match is not None else None
+
+
+def stale_templates(root, output, names):
+    """Returns the templates whose module is missing, older than the template or compiled by another version"""
+    stale = []
+    for name in names:
+        source = os.path.join(root, name)
+        target = os.path.join(output, module_path(name))
+        if not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source) or \
+                module_version(target) != __version__:
+            stale.append(name)
+    return stale
+
+
+def compile_tree(root, output, ignore_whitespace=False, extensions=EXTENSIONS, force=False, jobs=None):
+    """Compiles every template below root into output.
+
+  Templates whose module is newer than the template and was compiled by this
+  version are skipped unless force is set.  Returns the list of templates which were compiled, CompileError is
+  raised if any of them failed.
+  """
+    names = list(find_templates(root, extensions))
+    if not force:
+        names = stale_templates(root, output, names)
+    results = compile_many(root, names, ignore_whitespace, jobs, output=output, result=None)
+    failed = [result for result in results if result.error is not None]
+    if failed:
+        raise CompileError(failed)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compiles razor templates into python modules")
+    parser.add_argument('root', help="directory holding the templates")
+    parser.add_argument('output', nargs='?', help="directory the modules are written to")
+    parser.add_argument('-w', '--ignore-whitespace', action='store_true',
+                        help="strip the leading whitespace of every line")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="compile templates even if their module is up to date")
+    parser.add_argument('-e', '--extension', action='append', dest='extensions',
+                        help="template file extension, may be repeated (default: .pyhtml)")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="number of processes compiling templates, 0 uses every CPU")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="print the time each template took to compile")
+    parser.add_argument('--cache', help="bytecode cache directory the code objects are written to")
+    args = parser.parse_args(argv)
+    if args.output is None and args.cache is None:
+        parser.error("an output directory or --cache is required")
+
+    extensions = tuple(args.extensions or EXTENSIONS)
+    names = list(find_templates(args.root, extensions))
+    if args.output is not None and args.cache is None and not args.force:
+        names = stale_templates(args.root, args.output, names)
+    results = compile_many(args.root, names, args.ignore_whitespace, args.jobs, args.output, args.cache,
+                           result=None)
+    status = 0
+    for result in results:
+        if result.error is not None:
+            sys.stderr.write("%s: %s\n" % (result.name, result.error))
+            status = 1
+        elif args.verbose:
+            print("%8.2fms %s" % (result.seconds * 1000, result.name))
+        else:
+            print(result.name)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import os
+import sys
+import tempfile
+import unittest
+
+from razorview import PyRazor
+
+if sys.version_info >= (3, 6):
+    import asyncio
+
+
+class AsyncItems(object):
+    """An async iterable over items"""
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        if not self.items:
+            raise StopAsyncIteration
+        return asyncio.sleep(0, result=self.items.pop(0))
+
+
+class Writer(object):
+    """Records what is written to it like an asyncio StreamWriter"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+    def drain(self):
+        return asyncio.sleep(0)
+
+
+@unittest.skipIf(sys.version_info < (3, 6), "asyncio rendering needs python 3.6")
+class AsyncRenderTest(unittest.TestCase):
+    def setUp(self):
+        self.razor = PyRazor()
+        self.razor.Asynchronous = True
+
+    def run_async(self, coroutine):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    def testAwaitExpression(self):
+        """Tests that awaitable expressions are awaited"""
+        template = "<p>@model</p>"
+        self.assertEquals("<p>3</p>", self.run_async(self.razor.render_async(template, asyncio.sleep(0, result=3))))
+
+    def testAsyncFor(self):
+        """Tests that for loops iterate over async and plain iterables"""
+        template = "@for i in model:\n\t<li>@i</li>\n"
+        expected = PyRazor().render(template, [1, 2])
+        self.assertEquals(expected, self.run_async(self.razor.render_async(template, AsyncItems([1, 2]))))
+        self.assertEquals(expected, self.run_async(self.razor.render_async(template, [1, 2])))
+
+    def testHelper(self):
+        """Tests that functions defined by the template stay synchronous"""
+        template = "@def item(i):\n\t<b>@i</b>\n@for i in model:\n\t@item(i)\n"
+        self.assertEquals(PyRazor().render(template, [1, 2]),
+                          self.run_async(self.razor.render_async(template, AsyncItems([1, 2]))))
+
+    def testLayout(self):
+        """Tests that a view and its layout are both rendered asynchronously"""
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.pyhtml', delete=False) as f:
+            f.write("<body>@(model.title())</body>@view.body()")
+
+        class model:
+            def title(self):
+                return asyncio.sleep(0, result=3)
+
+        try:
+            template = "@view.wrap('" + f.name.replace('\\', '/') + "')\n<p>@model.title()</p>"
+            self.assertEquals("<body>3</body><p>3</p>", self.run_async(self.razor.render_async(template, model())))
+        finally:
+            os.remove(f.name)
+
+    def testPartial(self):
+        """Tests that awaitable values in partials and fragments are awaited"""
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.pyhtml', delete=False) as f:
+            f.write("<b>@model.value()</b>")
+
+        class model:
+            def value(self):
+                return asyncio.sleep(0, result=3)
+
+        try:
+            path = f.name.replace('\\', '/')
+            template = "<p>@view.tmpl('" + path + "')</p>\n" \
+                       "@view.fragment('" + path + "', 'part')\n" \
+                       "@view.fragment('" + path + "', 'part', 4)\n"
+            self.assertEquals("<p><b>3</b></p>\n<b>3</b><b>3</b>",
+                              self.run_async(self.razor.render_async(template, model())))
+            writer = Writer()
+            self.run_async(self.razor.stream_async(writer, template, model()))
+            self.assertEquals(b"<p><b>3</b></p>\n<b>3</b><b>3</b>", b"".join(writer.chunks))
+        finally:
+            os.remove(f.name)
+
+    def testStream(self):
+        """Tests that the output is written to the stream in chunks"""
+        template = "<ul>\n@for i in model:\n  <li>@i</li>\n</ul>"
+        writer = Writer()
+        self.run_async(self.razor.stream_async(writer, template, AsyncItems(range(100)), chunk_size=64))
+        self.assertTrue(len(writer.chunks) > 1)
+        self.assertEquals(PyRazor().render(template, range(100)), b"".join(writer.chunks).decode('utf-8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import razorview
+from razorview import PyRazor, View
+
+
+class BytecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testWarmStartSkipsCompile(self):
+        """Tests that a second engine loads the view from the cache"""
+        template = "<p>@model</p>"
+        self.assertEquals("<p>3</p>", PyRazor(self.directory).render(template, 3))
+        self.assertEquals(1, len(os.listdir(self.directory)))
+
+        compile = View.compile
+        try:
+            View.compile = staticmethod(lambda text, ignore_whitespace: self.fail("View was recompiled"))
+            self.assertEquals("<p>4</p>", PyRazor(self.directory).render(template, 4))
+        finally:
+            View.compile = staticmethod(compile)
+
+    def testKey(self):
+        """Tests that the whitespace flag and the engine version are part of the key"""
+        key = razorview.BytecodeCache.key
+        self.assertEquals(key("test", False, "1"), key("test", False, "1"))
+        self.assertNotEquals(key("test", False, "1"), key("test", True, "1"))
+        self.assertNotEquals(key("test", False, "1"), key("test", False, "2"))
+        self.assertNotEquals(key("test", False, "1"), key("test2", False, "1"))
+
+    def testCorruptEntry(self):
+        """Tests that an unreadable entry is rebuilt"""
+        razor = PyRazor(self.directory)
+        key = razor.Cache.key("test", False, razorview.__version__)
+        with open(razor.Cache.get_path(key), 'wb') as f:
+            f.write(b'garbage')
+        self.assertEquals("test", razor.render("test"))
+
+    def testDeletedDirectory(self):
+        """Tests that views still render when the cache directory is gone"""
+        razor = PyRazor(self.directory)
+        shutil.rmtree(self.directory)
+        try:
+            self.assertEquals("<p>1</p>", razor.render("<p>@model</p>", 1))
+            self.assertFalse(os.path.exists(self.directory))
+        finally:
+            os.mkdir(self.directory)
+
+    def testUncreatableDirectory(self):
+        """Tests that an engine whose cache directory can not be created renders without caching"""
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        razor = PyRazor(os.path.join(path, 'cache'))
+        self.assertEquals("<p>1</p>", razor.render("<p>@model</p>", 1))
+        self.assertEquals(['file'], os.listdir(self.directory))
+
+    def testExistingDirectory(self):
+        """Tests that engines sharing a cache directory which already exists start"""
+        PyRazor(self.directory)
+        self.assertEquals("<p>1</p>", PyRazor(self.directory).render("<p>@model</p>", 1))
+
+    @unittest.skipIf(not hasattr(os, 'geteuid') or os.geteuid() == 0, "root can write anywhere")
+    def testReadOnlyDirectory(self):
+        """Tests that views still render when the cache directory can not be written"""
+        razor = PyRazor(self.directory)
+        os.chmod(self.directory, 0o500)
+        try:
+            self.assertEquals("<p>1</p>", razor.render("<p>@model</p>", 1))
+        finally:
+            os.chmod(self.directory, 0o700)
+        self.assertEquals([], os.listdir(self.directory))
+
+
+if __name__ == '__main__':
+    unittest.main()
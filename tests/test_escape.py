@@ -0,0 +1,26 @@
+import unittest
+
+from escape import escape, Markup, text_type
+from razorview import PyRazor
+
+
+class EscapeTest(unittest.TestCase):
+    def testEscape(self):
+        self.assertEquals(u"&lt;a href=\"x\"&gt;&amp;amp;&lt;/a&gt;", escape(u"<a href=\"x\">&amp;</a>"))
+        self.assertEquals(u"3", escape(3))
+        self.assertEquals(u"None", escape(None))
+
+    def testPlainTextUntouched(self):
+        """Tests that text without special characters is returned as is"""
+        text = text_type("plain text")
+        self.assertTrue(escape(text) is text)
+
+    def testMarkup(self):
+        """Tests that markup is not escaped again"""
+        html = Markup(u"<b>bold</b>")
+        self.assertTrue(escape(html) is html)
+        self.assertEquals(u"<p><b>bold</b></p>", PyRazor().render("<p>@model</p>", html))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from cache import FileStore, FragmentCache
+from razorview import PyRazor
+
+
+class FragmentCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('menu.pyhtml', "<nav>@model.render()</nav>")
+        self.razor = PyRazor()
+        self.razor.ViewRoot = [self.root]
+        self.renders = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(text)
+
+    def render(self):
+        self.renders += 1
+        return self.renders
+
+    def testCachedBlock(self):
+        """Tests that a cached block is rendered once and invalidated by its tags"""
+        template = "<p>@for _ in view.cached('block', None, ['menu']):\n\t<b>@model.render()</b>\n</p>"
+        expected = self.razor.render(template, self)
+        self.assertEquals(expected, self.razor.render(template, self))
+        self.assertEquals(expected.encode('utf-8'), self.razor.render_bytes(template, self))
+        self.assertEquals(expected, u"".join(self.razor.render_segments(template, self)))
+        self.assertEquals(1, self.renders)
+        self.razor.Fragments.invalidate('menu')
+        self.assertEquals(expected.replace("1", "2"), self.razor.render(template, self))
+        self.assertEquals(2, self.renders)
+
+    def testCachedPartial(self):
+        """Tests that cached partials are rendered once per key until they expire"""
+        template = "@view.fragment('menu.pyhtml', 'menu', ttl=60)\n@view.fragment('menu.pyhtml', 'other')"
+        self.assertEquals("<nav>1</nav><nav>2</nav>", self.razor.render(template, self))
+        self.assertEquals("<nav>1</nav><nav>2</nav>", self.razor.render(template, self))
+        self.razor.Fragments.set('menu', u"<nav>old</nav>", ttl=-1)
+        self.assertEquals("<nav>3</nav><nav>2</nav>", self.razor.render(template, self))
+
+    def testDependencies(self):
+        """Tests that fragment partials are dependencies of the view"""
+        self.write('page.pyhtml', "@view.fragment('menu.pyhtml', 'menu')")
+        self.assertEquals(('menu.pyhtml',), self.razor.get_view('page.pyhtml').dependencies)
+
+    def testFileStore(self):
+        """Tests that fragments in a file store are shared between caches"""
+        directory = os.path.join(self.root, 'fragments')
+        first = FragmentCache(FileStore(directory))
+        second = FragmentCache(FileStore(directory))
+        first.set('nav', u"<nav/>", tags=['pages'])
+        self.assertEquals(u"<nav/>", second.get('nav'))
+        second.invalidate('pages')
+        self.assertEquals(None, first.get('nav'))
+        first.set('nav', u"<nav/>", ttl=60)
+        first.delete('nav')
+        self.assertEquals(None, second.get('nav'))
+
+
+if __name__ == '__main__':
+    unittest.main()
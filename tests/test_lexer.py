@@ -0,0 +1,64 @@
+import glob
+import os
+import unittest
+
+import lex
+import sexylexer
+from lex import RazorLexer
+
+
+def reference_lexer(ignore_whitespace=False):
+    """Returns a lexer using the regular expression for self closing tags"""
+    razor = RazorLexer.create(ignore_whitespace)
+
+    def rules(rules):
+        return tuple((name, (lex.XMLSELFCLOSE, rule[1])) if name == lex.Token.XMLSELFCLOSE else (name, rule)
+                     for name, rule in rules)
+
+    razor.lexer = sexylexer.Lexer(rules(razor.rules), rules(razor.multilineRules))
+    return razor
+
+
+class LexerTest(unittest.TestCase):
+    def assertSameTokens(self, text):
+        self.assertEquals(list(reference_lexer().scan(text)), list(RazorLexer.create().scan(text)))
+
+    def testSelfClose(self):
+        """Tests that self closing tags match the regular expression rule"""
+        self.assertSameTokens("<br/>\n<img src=\"a\" />  \n<p/> @model <a/>/>\t\n")
+        self.assertSameTokens("text /> more\n@if model:\n\t<br/>\n\t<hr />x\n/>")
+        self.assertSameTokens("@model</p>\n<br\n/>")
+
+    def testSamples(self):
+        """Tests that the sample templates are tokenized as before"""
+        root = os.path.join(os.path.dirname(__file__), "..", "sample")
+        for path in glob.glob(os.path.join(root, "*.pyhtml")):
+            with open(path) as f:
+                self.assertSameTokens(f.read())
+
+    def testParenString(self):
+        """Tests that parens inside strings do not end an expression"""
+        tokens = list(RazorLexer.create().scan("@(\")(\" + ')\\'') [x]"))
+        self.assertEquals((lex.Token.PARENEXPRESSION, "\")(\" + ')\\''"), tokens[0])
+        self.assertEquals((lex.Token.TEXT, " [x]"), tokens[1])
+
+    def testTokenPosition(self):
+        """Tests that the scanner reports the line and column of each token"""
+        scanner = RazorLexer.create().scan("<p>\n  @(model) <b>\n@x")
+        positions = []
+        for token in scanner:
+            positions.append((token[0], scanner.token_position()))
+        self.assertEquals((lex.Token.PARENEXPRESSION, (2, 3)), positions[2])
+        self.assertEquals((lex.Token.EXPRESSION, (3, 1)), positions[-1])
+
+    def testErrorPosition(self):
+        """Tests that an unclosed expression reports its line and column"""
+        try:
+            list(RazorLexer.create().scan("<p>\n</p>\n  @(model\n"))
+            self.fail("Expected an InvalidTokenError")
+        except sexylexer.InvalidTokenError as e:
+            self.assertEquals((3, 3), (e.lineno, e.column))
+
+
+if __name__ == '__main__':
+    unittest.main()
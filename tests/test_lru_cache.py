@@ -0,0 +1,54 @@
+import unittest
+
+from cache import LRUCache
+from razorview import PyRazor
+
+
+class LRUCacheTest(unittest.TestCase):
+    def testEntryLimit(self):
+        """Tests that the least recently used entry is evicted"""
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEquals(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertEquals(None, cache.get('b'))
+        self.assertEquals(1, cache.get('a'))
+        self.assertEquals(3, cache.get('c'))
+        self.assertEquals(dict(entries=2, bytes=0, hits=3, misses=1, evictions=1), cache.stats())
+
+    def testByteLimit(self):
+        """Tests that entries are evicted until the cache fits in its byte limit"""
+        cache = LRUCache(max_bytes=10)
+        cache.set('a', 1, 4)
+        cache.set('b', 2, 4)
+        cache.set('a', 1, 5)
+        self.assertEquals(9, cache.bytes)
+        cache.set('c', 3, 6)
+        self.assertEquals(['c'], list(cache._entries))
+        self.assertEquals(6, cache.bytes)
+        self.assertEquals(2, cache.evictions)
+
+    def testTtl(self):
+        """Tests that expired entries are misses"""
+        cache = LRUCache(ttl=-1)
+        cache.set('a', 1, 3)
+        self.assertEquals(None, cache.get('a'))
+        self.assertEquals(0, len(cache))
+        self.assertEquals(0, cache.bytes)
+
+    def testRenderBounded(self):
+        """Tests that views rendered from text are held in a bounded cache"""
+        razor = PyRazor()
+        razor.TextCache = LRUCache(max_entries=2)
+        for i in range(5):
+            self.assertEquals(str(i), razor.render(str(i)))
+        self.assertEquals("4", razor.render("4"))
+        self.assertEquals(2, len(razor.TextCache))
+        self.assertEquals(3, razor.TextCache.evictions)
+        self.assertEquals(1, razor.TextCache.hits)
+        self.assertTrue(razor.TextCache.bytes > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
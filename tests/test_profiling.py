@@ -0,0 +1,97 @@
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+import unittest
+
+from profiling import Profiler
+from razorview import PyRazor
+
+
+class ProfilingTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('layout.pyhtml', "<body>@view.body()</body>")
+        self.write('page.pyhtml', "@view.wrap('layout.pyhtml')\n<p>@view.tmpl('part.pyhtml')</p>")
+        self.write('part.pyhtml', "<b>@model</b>")
+        self.write('error.pyhtml', "<p>\n  text\n</p>\n@(model.missing)\n")
+        self.razor = PyRazor()
+        self.razor.ViewRoot = [self.root]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        with open(os.path.join(self.root, name), 'w') as f:
+            f.write(text)
+
+    def testStats(self):
+        """Tests that renders of views, partials and layouts are recorded"""
+        profiler = self.razor.enable_profiling()
+        self.razor.render_file('page.pyhtml', 3)
+        self.assertEquals("<body><p><b>3</b></p></body>", self.razor.render_file('page.pyhtml', 3))
+        self.assertEquals("<b>3</b>", "".join(self.razor.stream_file('part.pyhtml', 3)))
+
+        page = profiler.templates['page.pyhtml']
+        self.assertEquals((1, 2), (page.parses, page.renders))
+        self.assertEquals(2 * len("<body><p><b>3</b></p></body>"), page.bytes)
+        self.assertEquals({'layout': 2}, profiler.templates['layout.pyhtml'].kinds)
+        self.assertEquals({'tmpl': 2, 'stream': 1}, profiler.templates['part.pyhtml'].kinds)
+        self.assertEquals(3 * len("<b>3</b>"), profiler.templates['part.pyhtml'].bytes)
+        self.assertTrue('page.pyhtml' in profiler.report())
+
+        self.razor.disable_profiling()
+        self.assertFalse('render_file' in self.razor.__dict__)
+        self.razor.render_file('page.pyhtml', 3)
+        self.assertEquals(2, profiler.templates['page.pyhtml'].renders)
+
+    def testTraceback(self):
+        """Tests that tracebacks of profiled views point at the template line"""
+        self.razor.enable_profiling()
+        try:
+            self.razor.render_file('error.pyhtml', 3)
+            self.fail("Expected an AttributeError")
+        except AttributeError:
+            frames = traceback.extract_tb(sys.exc_info()[2])
+        path = os.path.join(self.root, 'error.pyhtml')
+        self.assertEquals([4], [frame[1] for frame in frames if frame[0] == path])
+
+    def testLines(self):
+        """Tests that the lines of a template are timed"""
+        self.write('loop.pyhtml', "@for i in range(model):\n\t<li>@i</li>\n<p>done</p>")
+        profiler = self.razor.enable_profiling(Profiler(lines=True))
+        self.razor.render_file('loop.pyhtml', 5)
+        path = os.path.join(self.root, 'loop.pyhtml')
+        self.assertEquals(set([1, 2, 3]), set(line for filename, line in profiler.lines if filename == path))
+        self.assertTrue('<li>@i</li>' in profiler.line_report())
+
+    def testBytecodeCache(self):
+        """Tests that profiled views are compiled from their own file even when the bytecode cache has them"""
+        cache = tempfile.mkdtemp()
+        try:
+            self.write('copy.pyhtml', "<p>\n  text\n</p>\n@(model.missing)\n")
+            for start in ('cold', 'warm'):
+                razor = PyRazor(cache)
+                razor.ViewRoot = [self.root]
+                profiler = razor.enable_profiling(Profiler(lines=True))
+                self.assertEquals("<b>3</b>", razor.render_file('part.pyhtml', 3))
+                for name in ('error.pyhtml', 'copy.pyhtml'):
+                    try:
+                        razor.render_file(name, 3)
+                        self.fail("Expected an AttributeError")
+                    except AttributeError:
+                        frames = traceback.extract_tb(sys.exc_info()[2])
+                    path = os.path.join(self.root, name)
+                    self.assertEquals([4], [frame[1] for frame in frames if frame[0] == path])
+
+            path = os.path.join(self.root, 'part.pyhtml')
+            self.assertEquals(1, profiler.templates['part.pyhtml'].parses)
+            self.assertTrue(path in profiler.filenames)
+            self.assertTrue([line for filename, line in profiler.lines if filename == path])
+        finally:
+            shutil.rmtree(cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,12 +5,13 @@
 """
 
 import unittest
-import cgi
 import tempfile
 import textwrap
 import os
+import threading
+import time
 
-from razorview import pyrazor
+from razorview import pyrazor, PyRazor
 
 
 class RenderTests(unittest.TestCase):
@@ -47,6 +48,109 @@ class RenderTests(unittest.TestCase):
         m['test'] = 3
         self.assertEquals("3", pyrazor.render("@model dict\n@model['test']", m))
 
+    def testCompile(self):
+        """Tests that a compiled view can be rendered repeatedly"""
+        razor = PyRazor()
+        view = razor.compile("<p>@model</p>")
+        self.assertEquals("<p>1</p>", view.render(1))
+        self.assertEquals("<p>2</p>", view.render(2))
+        self.assertTrue(view is razor.compile("<p>@model</p>"))
+        # The whitespace flag is part of the cache key
+        self.assertEquals("  test", razor.render("  test"))
+        self.assertEquals("test", razor.render("  test", ignore_whitespace=True))
+
+    def testStream(self):
+        """Tests that a streamed view yields its output in chunks"""
+        razor = PyRazor()
+        template = "<ul>\n@for i in model:\n  <li>@i</li>\n</ul>"
+        chunks = list(razor.stream(template, range(100), chunk_size=64))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(razor.render(template, range(100)), "".join(chunks))
+
+    def testStreamLayout(self):
+        """Tests that a view wrapped in a layout is streamed"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>\n@view.body()\n</body>")
+        try:
+            razor = PyRazor()
+            template = "@view.wrap('" + layout_file + "')\n<p>@model</p>"
+            self.assertEquals(razor.render(template, "test"), "".join(razor.stream(template, "test")))
+            self.assertEquals("<body>\n<p>test</p></body>", razor.render(template, "test"))
+        finally:
+            os.remove(layout_file)
+
+    def testIndirectWrap(self):
+        """Tests that a layout set through getattr or a helper given the view is not dropped"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>@view.body()</body>")
+        try:
+            razor = PyRazor()
+            for template, model in (("@getattr(view, 'wr' + 'ap')('" + layout_file + "')\n<p>@model</p>", "test"),
+                                    ("@model(view)\n<p>test</p>", lambda view: view.wrap(layout_file))):
+                self.assertTrue(razor.compile(template).wraps)
+                self.assertEquals("<body><p>test</p></body>", razor.render(template, model))
+                self.assertEquals("<body><p>test</p></body>", "".join(razor.stream(template, model)))
+                self.assertEquals(b"<body><p>test</p></body>", razor.compile(template).render_bytes(model))
+        finally:
+            os.remove(layout_file)
+
+    def testUnseenWrap(self):
+        """Tests that a layout set in a render which is not held back raises"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>@view.body()</body>")
+        try:
+            view = PyRazor().compile("@view.wrap('" + layout_file + "')\n<p>@model</p>")
+            view.wraps = False
+            self.assertRaises(RuntimeError, view.render, "test")
+            self.assertRaises(RuntimeError, list, view.stream("test"))
+        finally:
+            os.remove(layout_file)
+
+    def testRenderBytes(self):
+        """Tests that views render encoded bytes into buffers"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>@view.body()</body>")
+        try:
+            razor = PyRazor()
+            template = u"@view.wrap('" + layout_file + u"')\n<p>\u00e8 @model</p>"
+            expected = razor.render(template, u"\u00e0<")
+            self.assertEquals(expected.encode('utf-8'), razor.render_bytes(template, u"\u00e0<"))
+            self.assertEquals(expected.encode('utf-16-le'), razor.render_bytes(template, u"\u00e0<", encoding='utf-16-le'))
+            self.assertRaises(ValueError, razor.render_bytes, template, encoding='utf-16')
+            target = bytearray()
+            razor.compile(template).render_bytes_to(target, u"\u00e0<")
+            self.assertEquals(expected.encode('utf-8'), bytes(target))
+        finally:
+            os.remove(layout_file)
+
+    def testRenderSegments(self):
+        """Tests that views render into lists holding their static segments"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>@view.body()</body>")
+        try:
+            razor = PyRazor()
+            template = u"@view.wrap('" + layout_file + u"')\n<p>\u00e8 @model</p>"
+            expected = razor.render(template, u"\u00e0<")
+            parts = razor.render_segments(template, u"\u00e0<")
+            self.assertEquals(expected, u"".join(parts))
+            self.assertTrue(any(part is segment for part in parts
+                                for segment in razor.compile(template).template.__defaults__[-3]))
+            self.assertEquals(expected.encode('utf-8'), b"".join(razor.render_segments(template, u"\u00e0<",
+                                                                                       encoding='utf-8')))
+        finally:
+            os.remove(layout_file)
+
+    def testRenderMany(self):
+        """Tests that a view is rendered for each model in order"""
+        layout_file = RenderTests.__writeTemplateToFile("<body>@view.body()</body>")
+        tmpl_file = RenderTests.__writeTemplateToFile("@view.wrap('" + layout_file + "')\n<p>@model</p>")
+        try:
+            razor = PyRazor()
+            expected = [razor.render_file(tmpl_file, i) for i in range(5)]
+            self.assertEquals(expected, razor.render_many(tmpl_file, range(5)))
+            outputs = []
+            self.assertEquals(None, razor.render_many(tmpl_file, range(5), sink=outputs.append,
+                                                      processes=2, chunk_size=2))
+            self.assertEquals(expected, outputs)
+        finally:
+            os.remove(tmpl_file)
+            os.remove(layout_file)
+
     def testHtmlEscape(self):
         class test:
             pass
@@ -54,9 +158,9 @@ class RenderTests(unittest.TestCase):
         model = test()
         model.a = "<html>"
         self.assertEquals("<html>", pyrazor.render("@!model.a", model))
-        self.assertEquals(cgi.escape("<html>"), pyrazor.render("@model.a", model))
+        self.assertEquals("&lt;html&gt;", pyrazor.render("@model.a", model))
         self.assertEquals("<html>", pyrazor.render("@!(model.a)", model))
-        self.assertEquals(cgi.escape("<html>"), pyrazor.render("@(model.a)", model))
+        self.assertEquals("&lt;html&gt;", pyrazor.render("@(model.a)", model))
 
     def testHtml(self):
         html = textwrap.dedent("""\
@@ -127,6 +231,63 @@ class RenderTests(unittest.TestCase):
         finally:
             os.remove(tmpl_file)
 
+    def testTmplLayout(self):
+        """Tests that a template rendered by tmpl is put in its own layout"""
+        layout_file = RenderTests.__writeTemplateToFile("<div>@view.body()</div>")
+        tmpl_file = RenderTests.__writeTemplateToFile("@view.wrap('" + layout_file + "')\n@model")
+        try:
+            template = '<body>@view.tmpl("' + tmpl_file + '")</body>'
+            self.assertEquals("<body><div>test</div></body>", PyRazor().render(template, "test"))
+        finally:
+            os.remove(tmpl_file)
+            os.remove(layout_file)
+
+    def testAutoReload(self):
+        """Tests that a changed template file is only picked up when auto reloading"""
+        tmpl_file = RenderTests.__writeTemplateToFile("one")
+        try:
+            razor = PyRazor()
+            self.assertEquals("one", razor.render_file(tmpl_file))
+            with open(tmpl_file, 'w') as f:
+                f.write("three")
+            self.assertEquals("one", razor.render_file(tmpl_file))
+
+            razor.AutoReload = True
+            razor.ReloadInterval = 3600
+            self.assertEquals("one", razor.render_file(tmpl_file))
+            razor.ReloadInterval = 0
+            self.assertEquals("three", razor.render_file(tmpl_file))
+        finally:
+            os.remove(tmpl_file)
+
+    def testConcurrentRender(self):
+        """Tests that one view can be rendered by several threads at once"""
+
+        class model:
+            def __init__(self, name):
+                self.name = name
+
+            def wait(self):
+                time.sleep(0.01)
+
+        tmpl_file = RenderTests.__writeTemplateToFile("<b>@model.name</b>")
+        try:
+            razor = PyRazor()
+            view = razor.compile('@model.wait()\n@view.tmpl("' + tmpl_file + '")')
+            results = dict()
+
+            def render(name):
+                results[name] = view.render(model(name))
+
+            threads = [threading.Thread(target=render, args=(str(i),)) for i in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEquals(dict((str(i), "<b>%d</b>" % i) for i in range(8)), results)
+        finally:
+            os.remove(tmpl_file)
+
     @staticmethod
     def __writeTemplateToFile(template):
         """Writes a template out to a temporary file.
@@ -134,7 +295,7 @@ class RenderTests(unittest.TestCase):
        The file is closed and the file name returned.
        The file is automatically deleted if an exception occurs
     """
-        file = tempfile.NamedTemporaryFile(delete=False)
+        file = tempfile.NamedTemporaryFile(mode='w', delete=False)
         path = file.name.replace('\\', '/')
         try:
             file.write(template)
@@ -0,0 +1,127 @@
+import textwrap
+import threading
+import unittest
+
+from razorview import Reparser, View
+
+
+def template_source(text, ignore_whitespace=False):
+    """Returns the generated source of the template function"""
+    source = View.generate(text, ignore_whitespace).get_template()
+    return source[:source.index("\ndef stream(")]
+
+
+class ViewBuilderTest(unittest.TestCase):
+    def testCoalesceText(self):
+        """Tests that static lines are written by a single statement"""
+        html = textwrap.dedent("""\
+        <html>
+          <head>
+            <title>Alex's</title>
+          </head>
+        </html>""")
+        self.assertEquals(1, template_source(html).count("write("))
+
+    def testCoalesceKeepsScope(self):
+        """Tests that text is only merged within a scope"""
+        source = template_source("a\n@if model:\n\tb\n\tc\nd\ne")
+        self.assertEquals(3, source.count("write("))
+
+    def testHoistedSegments(self):
+        """Tests that static text is hoisted out of the template and shared"""
+        builder = View.generate("<p>@model</p>\n<p>@model</p>", False)
+        self.assertTrue("__write = __io.write" in builder.get_template())
+        self.assertEquals([u"<p>", u"</p>\n<p>", u"</p>"], builder.segments)
+        builder = View.generate("@model\n@model\n", False)
+        builder.close()
+        self.assertEquals([u"\n"], builder.segments)
+
+    def testLiteralExpression(self):
+        """Tests that literal expressions are written as static text"""
+        builder = View.generate('<p>@("<b>")</p>@!("<i>")@(3)', False)
+        self.assertFalse("__e =" in builder.get_template())
+        self.assertEquals([u"<p>&lt;b&gt;</p><i>3"], builder.segments)
+
+    def testExpressionNewLine(self):
+        """Tests that the new line after an expression is only written if it printed something"""
+        render = lambda text, model=None: View(None, View.parse(text, False), False, "").render(model)
+        self.assertEquals(u"a\nb", render("@model\nb", "a"))
+        self.assertEquals(u"b", render("@model\nb"))
+        self.assertEquals(u"b", render("@None\nb"))
+        self.assertEquals(u"a\nb", render("@('a')\nb"))
+        self.assertEquals(u"None\nb", render("@!model\nb", "None"))
+
+    def testBackslash(self):
+        """Tests that text is written literally"""
+        self.assertEquals(u"a\\nb\\", View(None, View.parse("a\\nb\\", False), False, "").render())
+
+    def testConstantFolding(self):
+        """Tests that loops over literals and ifs over constants are rendered once when compiled"""
+        text = "<ul>\n@for i in [1, 2]:\n\t<li>@i</li>\n</ul>\n@if False:\n\t<p>@model</p>\n@i"
+        template = View.parse(text, False)
+        self.assertEquals(u"<ul>\n\t<li>1</li>\n\t<li>2</li>\n</ul>\n", template.__defaults__[-3][-1])
+        self.assertEquals(u"<ul>\n\t<li>1</li>\n\t<li>2</li>\n</ul>\n2", View(None, template, False, "").render(3))
+        self.assertEquals(u"<ul>\n\t<li>1</li>\n\t<li>2</li>\n</ul>\n2",
+                          "".join(View(None, template, False, "").stream(3)))
+        # Loops over the model are left alone
+        text = "@for i in [1, 2]:\n\t@if i > 1:\n\t\t<li>@model</li>"
+        self.assertEquals(u"\t\t<li>3</li>", View(None, View.parse(text, False), False, "").render(3))
+
+    def testViewFromText(self):
+        """Tests that a view can still be built from the template text"""
+        self.assertEquals(u"<p>3</p>", View(None, u"<p>@model</p>", False, "").render(3))
+        self.assertEquals(u"<p>3</p>", View(None, View.parse("<p>@model</p>", False), False, "").render(3))
+
+    def testFoldingRebound(self):
+        """Tests that calls to names the template rebinds are not folded"""
+        text = "@:\n  range = lambda n: [9]\n@for i in range(2):\n  <b>@i</b>\n"
+        self.assertEquals(u"  <b>9</b>\n", View(None, View.parse(text, False), False, "").render(3))
+        text = "@def f(range):\n\t@for i in range(2):\n\t\t<b>@i</b>\n@f(lambda n: [7])\n"
+        self.assertEquals(u"\t\t<b>7</b>\n", View(None, View.parse(text, False), False, "").render(3))
+        text = "@from json import dumps as range\n@for i in range(2):\n\t<b>@i</b>\n"
+        self.assertEquals(u"\t<b>2</b>\n", View(None, View.parse(text, False), False, "").render(3))
+
+    def testFoldingSize(self):
+        """Tests that constants too big to keep are left to the render"""
+        template = View.parse("@if len('a' * 10**10) > 3:\n\t<p>big</p>\n", False)
+        self.assertTrue('len' in template.__code__.co_names)
+        template = View.parse("@if len(str(2 ** 10 ** 10)) > 3:\n\t<p>big</p>\n", False)
+        self.assertTrue('len' in template.__code__.co_names)
+        template = View.parse("@for i in range(10**12):\n\t<p>@i</p>\n", False)
+        self.assertTrue('range' in template.__code__.co_names)
+
+    def testReparse(self):
+        """Tests that an edited template is only lexed around the change"""
+        block = "<h1>@model</h1>\n@if model:\n\t<p>@(model + 1)</p>\n<br/>\n"
+        text = block * 50
+        reparser = Reparser(False)
+        reparser.generate(text)
+        edited = block * 20 + "<h2>@model</h2>\n" + block * 30
+        self.assertEquals(View.generate(edited, False).get_template(), reparser.generate(edited).get_template())
+        self.assertTrue(0 < reparser.lexed < 20)
+        self.assertTrue(reparser.lexed + reparser.reused < len(reparser.tokens))
+
+    def testConcurrentReparse(self):
+        """Tests that versions parsed by several threads at once each get their own code"""
+        block = "<h1>@model</h1>\n@if model:\n\t<p>@(model + 1)</p>\n<br/>\n"
+        texts = [block * i + "<h2>@model</h2>\n" + block * (40 - i) for i in range(0, 40, 5)]
+        expected = [View.generate(text, False).get_template() for text in texts]
+        reparser = Reparser(False)
+        failures = []
+
+        def parse(offset):
+            for i in range(20):
+                index = (offset + i) % len(texts)
+                if reparser.generate(texts[index]).get_template() != expected[index]:
+                    failures.append(index)
+
+        threads = [threading.Thread(target=parse, args=(offset,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEquals([], failures)
+
+
+if __name__ == '__main__':
+    unittest.main()
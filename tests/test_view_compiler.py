@@ -0,0 +1,86 @@
+import marshal
+import os
+import shutil
+import tempfile
+import unittest
+
+import razorview
+import viewcompiler
+from razorview import PyRazor, View
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sample')
+
+
+class ViewCompilerTest(unittest.TestCase):
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def testCompileTree(self):
+        """Tests that every template is written out as a module"""
+        compiled = viewcompiler.compile_tree(SAMPLE, self.output)
+        self.assertEquals(['child.pyhtml', 'helloWorld.pyhtml', 'layout.pyhtml'], compiled)
+        for name in compiled:
+            self.assertTrue(os.path.exists(os.path.join(self.output, viewcompiler.module_path(name))))
+
+        # Up to date modules are skipped
+        self.assertEquals([], viewcompiler.compile_tree(SAMPLE, self.output))
+
+    def testCompileTreeVersion(self):
+        """Tests that modules compiled by another version of the engine are compiled again"""
+        viewcompiler.compile_tree(SAMPLE, self.output)
+        path = os.path.join(self.output, viewcompiler.module_path('layout.pyhtml'))
+        with open(path) as f:
+            module = f.read()
+        self.assertEquals(razorview.__version__, viewcompiler.module_version(path))
+        with open(path, 'w') as f:
+            f.write(module.replace("VERSION = %r" % razorview.__version__, "VERSION = '0.0.1'"))
+        self.assertEquals(['layout.pyhtml'], viewcompiler.compile_tree(SAMPLE, self.output))
+        self.assertEquals(razorview.__version__, viewcompiler.module_version(path))
+
+    def testRenderCompiled(self):
+        """Tests that compiled modules render like the templates they came from"""
+        viewcompiler.main([SAMPLE, self.output])
+
+        expected = PyRazor()
+        expected.ViewRoot = [SAMPLE]
+        razor = PyRazor()
+        razor.ViewRoot = []
+        razor.CompiledRoot = [self.output]
+        self.assertEquals(expected.render_file('helloWorld.pyhtml', 'Hi'),
+                          razor.render_file('helloWorld.pyhtml', 'Hi'))
+        self.assertEquals(expected.render_file('child.pyhtml', 'Hi'),
+                          razor.render_file('child.pyhtml', 'Hi'))
+
+    def testCompileMany(self):
+        """Tests that templates compiled by a process pool come back in order with their errors"""
+        with open(os.path.join(self.output, 'broken.pyhtml'), 'w') as f:
+            f.write("@(model")
+        results = viewcompiler.compile_many(SAMPLE, jobs=2) + viewcompiler.compile_many(self.output, jobs=2)
+        self.assertEquals(['child.pyhtml', 'helloWorld.pyhtml', 'layout.pyhtml', 'broken.pyhtml'],
+                          [result.name for result in results])
+        self.assertEquals([None, None, None], [result.error for result in results[:3]])
+        self.assertTrue('InvalidTokenError' in results[3].error)
+        with open(os.path.join(SAMPLE, 'helloWorld.pyhtml')) as f:
+            expected = View.compile(f.read(), False)
+        self.assertEquals(marshal.dumps(expected), results[1].code)
+
+    def testPrimeCache(self):
+        """Tests that the cache written by the command line is used by the engine"""
+        self.assertEquals(0, viewcompiler.main(['-j', '2', '--cache', self.output, SAMPLE]))
+        self.assertEquals(3, len(os.listdir(self.output)))
+
+        razor = PyRazor(self.output)
+        razor.ViewRoot = [SAMPLE]
+        compile = View.compile
+        try:
+            View.compile = staticmethod(lambda text, ignore_whitespace: self.fail("View was recompiled"))
+            razor.render_file('helloWorld.pyhtml', 'Hi')
+        finally:
+            View.compile = staticmethod(compile)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from razorview import PyRazor, View
+
+
+class WarmupTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.write('layout.pyhtml', "<body>@view.body()</body>")
+        self.write('page.pyhtml', "@view.wrap('layout.pyhtml')\n<p>@view.tmpl(\"parts/part.pyhtml\")</p>")
+        self.write(os.path.join('parts', 'part.pyhtml'), "<b>@model</b>")
+        self.razor = PyRazor()
+        self.razor.ViewRoot = [self.root]
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def write(self, name, text):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def testDependencies(self):
+        """Tests that literal tmpl and wrap targets are found when generating code"""
+        builder = View.generate("@view.wrap('a.pyhtml')\n@view.tmpl(\"b\", model)\n@view.tmpl(name)", False)
+        self.assertEquals([('wrap', 'a.pyhtml'), ('tmpl', 'b')], builder.dependencies)
+
+    def testWarmup(self):
+        """Tests that warmup loads every view and returns the dependency graph"""
+        graph = self.razor.warmup()
+        self.assertEquals({
+            'layout.pyhtml': (),
+            'page.pyhtml': ('layout.pyhtml', 'parts/part.pyhtml'),
+            os.path.join('parts', 'part.pyhtml'): (),
+        }, graph)
+        self.assertEquals("<body><p><b>3</b></p></body>", self.razor.render_file('page.pyhtml', 3))
+
+    def testWarmupProcesses(self):
+        """Tests that views compiled by a process pool render the same"""
+        self.assertEquals(3, len(self.razor.warmup(processes=2)))
+        self.assertEquals("<body><p><b>3</b></p></body>", self.razor.render_file('page.pyhtml', 3))
+
+    def testSubdirectory(self):
+        """Tests that the views below a subdirectory of a ViewRoot keep their names"""
+        graph = self.razor.warmup(os.path.join(self.root, 'parts'))
+        self.assertEquals({os.path.join('parts', 'part.pyhtml'): ()}, graph)
+        self.assertEquals("<b>3</b>", self.razor.render_file('parts/part.pyhtml', 3))
+
+    def testTrailingSeparator(self):
+        """Tests that a root ending in a separator names views like the ViewRoot does"""
+        graph = self.razor.warmup(self.root + os.sep)
+        self.assertEquals(sorted(['layout.pyhtml', 'page.pyhtml', os.path.join('parts', 'part.pyhtml')]), sorted(graph))
+
+    def testRelativeRoot(self):
+        """Tests that a relative root is resolved against the working directory"""
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            self.razor.ViewRoot = ['']
+            graph = self.razor.warmup('.')
+        finally:
+            os.chdir(cwd)
+        self.assertEquals(sorted(['layout.pyhtml', 'page.pyhtml', os.path.join('parts', 'part.pyhtml')]), sorted(graph))
+
+    def testOutsideRoot(self):
+        """Tests that a root outside every ViewRoot is refused"""
+        self.assertRaises(ValueError, self.razor.warmup, os.path.dirname(self.root))
+
+    def testErrors(self):
+        """Tests that a view which fails to load does not stop the others"""
+        self.write('broken.pyhtml', "@if:\n")
+        self.write('orphan.pyhtml', "@view.tmpl('missing.pyhtml')")
+        for processes in (None, 2):
+            razor = PyRazor()
+            razor.ViewRoot = [self.root]
+            errors = dict()
+            graph = razor.warmup(processes=processes, errors=errors)
+            self.assertEquals(['broken.pyhtml', 'missing.pyhtml'], sorted(errors))
+            self.assertEquals(4, len(graph))
+            self.assertEquals("<body><p><b>3</b></p></body>", razor.render_file('page.pyhtml', 3))
+
+    def testInvalidate(self):
+        """Tests that invalidating a layout drops the views wrapped in it"""
+        self.razor.warmup()
+        self.razor.invalidate('layout.pyhtml')
+        self.assertEquals([os.path.join('parts', 'part.pyhtml')], list(self.razor.dependency_graph()))
+
+
+if __name__ == '__main__':
+    unittest.main()